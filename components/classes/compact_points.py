@@ -0,0 +1,234 @@
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableMapping, ItemsView
+from itertools import islice
+
+_DELETED = object() # overlay tombstone for a user removed from the base arrays
+
+
+class CompactPoints(MutableMapping):
+
+    """{user id: points} mapping for very large guilds, stored as two sorted parallel arrays instead of a dict.
+
+    a dict costs 100+ bytes per member once the int objects are counted, the arrays cost 16. lookups are a
+    bisect into user_ids. points of users already in the arrays are updated in place, new users go into a
+    small overlay dict that is merged into the arrays once it grows past merge_threshold entries (or a
+    fraction of the guild, whichever is larger), so the merge cost is spread over many inserts.
+
+    points are always stored as ints"""
+
+    def __init__(self, points=None, merge_threshold: int = 4096):
+        self.user_ids = array("Q")
+        self.points = array("q")
+        self.overlay = {} # user id -> points for users not in the arrays, or _DELETED
+        self.merge_threshold = merge_threshold
+        self.size = 0
+        if points:
+            ordered = sorted(points.items())
+            self.user_ids = array("Q", (user_id for user_id, _ in ordered))
+            self.points = array("q", (int(user_points) for _, user_points in ordered))
+            self.size = len(ordered)
+
+    @classmethod
+    def from_arrays(cls, user_ids: array, points: array, merge_threshold: int = 4096) -> "CompactPoints":
+        """wraps arrays that are already sorted by user id (e.g. from points_snapshot.read_snapshot_arrays)"""
+        compact = cls(merge_threshold=merge_threshold)
+        compact.user_ids = user_ids
+        compact.points = points
+        compact.size = len(user_ids)
+        return compact
+
+    def _index(self, user_id: int) -> int:
+        """position of user_id in the arrays, or -1"""
+        i = bisect_left(self.user_ids, user_id)
+        if i < len(self.user_ids) and self.user_ids[i] == user_id:
+            return i
+        return -1
+
+    # MAPPING ==========================================================================================================
+
+    def __getitem__(self, user_id):
+        value = self.overlay.get(user_id)
+        if value is _DELETED:
+            raise KeyError(user_id)
+        if value is not None:
+            return value
+        i = self._index(user_id)
+        if i < 0:
+            raise KeyError(user_id)
+        return self.points[i]
+
+    def __setitem__(self, user_id, value):
+        value = int(value)
+        if user_id in self.overlay:
+            if self.overlay[user_id] is _DELETED:
+                self.size += 1
+            self.overlay[user_id] = value
+            return
+        i = self._index(user_id)
+        if i >= 0:
+            self.points[i] = value
+            return
+        self.overlay[user_id] = value
+        self.size += 1
+        if len(self.overlay) >= max(self.merge_threshold, len(self.user_ids) >> 4):
+            self.merge()
+
+    def __delitem__(self, user_id):
+        value = self.overlay.get(user_id)
+        if value is _DELETED:
+            raise KeyError(user_id)
+        if value is not None and self._index(user_id) < 0:
+            del self.overlay[user_id]
+        elif value is not None or self._index(user_id) >= 0:
+            self.overlay[user_id] = _DELETED
+        else:
+            raise KeyError(user_id)
+        self.size -= 1
+
+    def __contains__(self, user_id):
+        value = self.overlay.get(user_id)
+        if value is not None:
+            return value is not _DELETED
+        return self._index(user_id) >= 0
+
+    def __iter__(self):
+        for user_id, _ in self.items():
+            yield user_id
+
+    def __len__(self):
+        return self.size
+
+    def items(self):
+        return CompactPointsItems(self)
+
+    def iter_items(self):
+        """yields (user id, points) in no particular order without a lookup per user"""
+        overlay = self.overlay
+        for user_id, points in zip(self.user_ids, self.points):
+            if user_id in overlay:
+                continue # deleted, or deleted and added back
+            yield user_id, points
+        for user_id, points in overlay.items():
+            if points is not _DELETED:
+                yield user_id, points
+
+    def copy(self) -> "CompactPoints":
+        """point-in-time copy, the arrays are copied with a memcpy"""
+        self.merge()
+        return CompactPoints.from_arrays(array("Q", self.user_ids), array("q", self.points), self.merge_threshold)
+
+    # MERGING ==========================================================================================================
+
+    def merge(self):
+        """folds the overlay into the sorted arrays"""
+        if not self.overlay:
+            return
+        self.user_ids, self.points = self._merged_arrays()
+        self.overlay = {}
+        self.size = len(self.user_ids)
+
+    def merged(self) -> "CompactPoints":
+        """a merged copy, leaving this one (and its arrays) untouched for whoever else is reading it"""
+        if not self.overlay:
+            return self.copy()
+        user_ids, points = self._merged_arrays()
+        return CompactPoints.from_arrays(user_ids, points, self.merge_threshold)
+
+    def _merged_arrays(self) -> tuple[array, array]:
+        """new arrays holding the base arrays with the overlay applied, the old ones aren't modified"""
+        additions = sorted((user_id, points) for user_id, points in self.overlay.items() if points is not _DELETED)
+        deleted = {user_id for user_id, points in self.overlay.items() if points is _DELETED}
+
+        base_ids = self.user_ids
+        base_points = self.points
+        if deleted:
+            # departed members are archived in bulk (see basic.archive_departed_points), so find the deleted
+            # users with a bisect each and copy the runs between them in slices, never looping over the guild
+            removed = sorted(i for i in map(self._index, deleted) if i >= 0)
+            kept_ids = array("Q")
+            kept_points = array("q")
+            start = 0
+            for i in removed:
+                kept_ids.extend(base_ids[start:i])
+                kept_points.extend(base_points[start:i])
+                start = i + 1
+            kept_ids.extend(base_ids[start:])
+            kept_points.extend(base_points[start:])
+            base_ids = kept_ids
+            base_points = kept_points
+
+        # copy the runs of the old arrays between insertion points in slices rather than one by one
+        user_ids = array("Q")
+        points = array("q")
+        i = 0
+        for new_id, new_points in additions:
+            j = bisect_left(base_ids, new_id, i)
+            user_ids.extend(base_ids[i:j])
+            points.extend(base_points[i:j])
+            if j < len(base_ids) and base_ids[j] == new_id:
+                j += 1 # deleted and added back, the overlay value wins
+            user_ids.append(new_id)
+            points.append(new_points)
+            i = j
+        user_ids.extend(base_ids[i:])
+        points.extend(base_points[i:])
+        return user_ids, points
+
+    # MEMORY ===========================================================================================================
+
+    def memory_usage(self) -> int:
+        """bytes held by the arrays and the overlay"""
+        arrays = self.user_ids.buffer_info()[1] * self.user_ids.itemsize + self.points.buffer_info()[1] * self.points.itemsize
+        overlay = sys.getsizeof(self.overlay) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in self.overlay.items())
+        return arrays + overlay
+
+
+class CompactPointsItems(ItemsView):
+
+    def __iter__(self):
+        return self._mapping.iter_items()
+
+
+def dict_memory_usage(points, sample: int | None = None) -> int:
+    """bytes a plain {user id: points} dict of points takes, including the int objects (small ints are shared,
+    so they're not counted). with sample only that many entries are measured and the rest is scaled up"""
+    entries = list(islice(points.items(), sample))
+    if not entries:
+        return sys.getsizeof({})
+    size = sys.getsizeof(dict(entries))
+    for user_id, user_points in entries:
+        size += sys.getsizeof(user_id)
+        if not -5 <= user_points <= 256:
+            size += sys.getsizeof(user_points)
+    return size * len(points) // len(entries)
+
+def memory_report(points, sample: int | None = 1024) -> dict:
+    """memory used by a guild's points (a PointsTable, CompactPoints or dict), next to what they would take as
+    a CompactPoints and as a dict. a PointsTable's rank index and active member set are counted too, they hold
+    every ranked user again. dicts are estimated from sample entries, None measures all of them"""
+    data = getattr(points, "data", points)
+    users = len(data)
+    compact = isinstance(data, CompactPoints)
+    compact_bytes = data.memory_usage() if compact else users * 16 # the two arrays
+    dict_bytes = dict_memory_usage(data, sample)
+
+    rank_index = getattr(points, "rank_index", None)
+    active = getattr(points, "active", None)
+    rank_index_bytes = rank_index.memory_usage() if rank_index is not None else 0
+    # only the set itself, the ids in it are the same int objects as in discord's member cache
+    active_bytes = sys.getsizeof(active) if active is not None else 0
+    total_bytes = (compact_bytes if compact else dict_bytes) + rank_index_bytes + active_bytes
+    return {
+        "users": users,
+        "compact": compact,
+        "compact_bytes": compact_bytes,
+        "dict_bytes": dict_bytes,
+        "rank_index_bytes": rank_index_bytes,
+        "active_bytes": active_bytes,
+        "total_bytes": total_bytes,
+        "compact_bytes_per_user": compact_bytes / max(users, 1),
+        "dict_bytes_per_user": dict_bytes / max(users, 1),
+        "total_bytes_per_user": total_bytes / max(users, 1),
+    }
@@ -1,5 +1,6 @@
 import discord
 from discord.ext import commands
+import asyncio
 import os
 import yaml
 from pathlib import Path
@@ -10,7 +11,7 @@ ROOT_DIR = Path(__file__).parents[2]
 DEFAULT_CONFIGS_DIR = ROOT_DIR / "components" / "resources" / "default_configs"
 
 from components.function.logging import log
-from components.function.savedata import set_guild_attribute, get_guild_attribute
+from components.function.savedata import set_guild_attribute, get_guild_attribute, aset_guild_attribute, run_io
 
 COG_LABELS = []
 COG_CONFIGS = {}
@@ -57,6 +58,8 @@ class ConfigHandler:
         self.guild_id = guild.id
         self.guild_name = guild.name
         self.config = None
+        self.version = 0 # bumped whenever config changes, so things compiled from it can tell they're stale
+        self.loading = None # future of the load in progress, shared by everyone waiting on it
 
     def register_object(self):
         """registers the object in the config registry"""
@@ -77,12 +80,43 @@ class ConfigHandler:
                 config["colour"] = tuple(colour)
         self.default_config = default_config
         self.config = config
+        self.version += 1
 
     def save_config(self):
         """saves the config for this guild."""
         set_guild_attribute(self.guild_id, key=self.label, value=self.config)
         log(f"~2saved levels config for {self.guild_name}")
 
+    async def aload_config(self):
+        """loads the config for this guild on the savedata i/o thread."""
+        await run_io(self.load_config)
+
+    async def ensure_loaded(self):
+        """loads the config off the event loop if it hasn't been loaded yet, so later get_attribute calls never touch the disk.
+        concurrent callers wait on the same load, so a second load can't overwrite a change made after the first."""
+        if self.config is not None:
+            return
+        if self.loading is None:
+            self.loading = asyncio.ensure_future(self.aload_config())
+            self.loading.add_done_callback(lambda _: setattr(self, "loading", None))
+        await asyncio.shield(self.loading)
+
+    async def asave_config(self):
+        """saves the config for this guild without blocking the event loop."""
+        await aset_guild_attribute(self.guild_id, key=self.label, value=self.config)
+        log(f"~2saved {self.label} for {self.guild_name}")
+
+    async def aset_attributes(self, changes: dict):
+        """sets several attributes at once, so nothing ever sees some of them changed and the rest not. one
+        version bump and one write for all of them."""
+        await self.ensure_loaded()
+        for attribute in changes:
+            if attribute not in self.config:
+                log(f"~3attribute {attribute} not found in config {self.label}, it is being created.")
+        self.config.update(changes)
+        self.version += 1
+        await self.asave_config()
+
     def get_attribute(self, attribute, fallback=None):
         """gets an attribute from the config, returns fallback if not found, default fallback is None"""
         if self.config is None:
@@ -125,4 +159,14 @@ class ConfigHandler:
         if attribute not in self.config: # ~3 is yellow (warning)
             log(f"~3attribute {attribute} not found in config {self.label}, it is being created.")
         self.config[attribute] = value
-        self.save_config()
\ No newline at end of file
+        self.version += 1
+        self.save_config()
+
+    async def aset_attribute(self, attribute, value):
+        """async set_attribute, the write happens on the savedata i/o thread."""
+        await self.ensure_loaded()
+        if attribute not in self.config:
+            log(f"~3attribute {attribute} not found in config {self.label}, it is being created.")
+        self.config[attribute] = value
+        self.version += 1
+        await self.asave_config()
\ No newline at end of file
@@ -0,0 +1,74 @@
+import heapq
+import time
+
+
+class CooldownTracker:
+
+    """message cooldowns per (guild, user), forgotten once they run out.
+
+    each cooldown goes into the bucket of bucket_seconds its expiry falls in, and a heap of bucket numbers
+    says which bucket is due next, so expiring is popping whole buckets instead of scanning every entry.
+    memory is proportional to the users who spoke within the last cooldown, not everyone ever seen"""
+
+    def __init__(self, bucket_seconds: float = 5):
+        self.bucket_seconds = bucket_seconds
+        self.entries = {}       # (guild id, user id) -> (started, points awarded, expires)
+        self.buckets = {}       # bucket number -> keys expiring in it
+        self.bucket_heap = []   # bucket numbers in self.buckets
+        self.expired = 0        # entries expired so far
+
+    def claim(self, guild_id: int, user_id: int, amount: int, cooldown: float, now: float = None) -> int:
+        """returns how many of amount points a message should award. outside a cooldown that's all of them
+        (and a cooldown starts), inside one only the part above the biggest award so far"""
+        now = time.time() if now is None else now
+        self.expire(now)
+
+        key = (guild_id, user_id)
+        entry = self.entries.get(key)
+        if entry is not None and now - entry[0] < cooldown:
+            started, awarded, expires = entry
+            if amount <= awarded:
+                return 0
+            self.entries[key] = (started, amount, expires)
+            return amount - awarded
+
+        if entry is not None:
+            self._remove(key, entry[2])
+        expires = now + cooldown
+        self.entries[key] = (now, amount, expires)
+        bucket = int(expires // self.bucket_seconds)
+        keys = self.buckets.get(bucket)
+        if keys is None:
+            keys = self.buckets[bucket] = set()
+            heapq.heappush(self.bucket_heap, bucket)
+        keys.add(key)
+        return amount
+
+    def _remove(self, key: tuple, expires: float):
+        del self.entries[key]
+        keys = self.buckets.get(int(expires // self.bucket_seconds))
+        if keys is not None:
+            keys.discard(key) # the bucket itself goes when it comes due
+
+    def expire(self, now: float = None) -> int:
+        """drops every cooldown that ran out before the current bucket, returns how many"""
+        now = time.time() if now is None else now
+        current = int(now // self.bucket_seconds)
+        removed = 0
+        while self.bucket_heap and self.bucket_heap[0] < current:
+            for key in self.buckets.pop(heapq.heappop(self.bucket_heap)):
+                del self.entries[key]
+                removed += 1
+        self.expired += removed
+        return removed
+
+    def forget_guild(self, guild_id: int):
+        for key in [key for key in self.entries if key[0] == guild_id]:
+            self._remove(key, self.entries[key][2])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self) -> dict:
+        """size metrics, same idea as savedata.get_cache_stats"""
+        return {"size": len(self.entries), "buckets": len(self.buckets), "expired": self.expired}
@@ -0,0 +1,49 @@
+from array import array
+from bisect import bisect_left
+
+from components.classes.rank_index import RankIndex
+
+
+class GlobalLeaderboard:
+
+    """users ranked by their points across every guild they share with the bot, in one mode ("sum" or "max").
+    only each guild's top users go into it, so someone who isn't near the top of any guild isn't on it.
+
+    built once from arrays sorted by user id (see global_leaderboard.merge_guild_points) and never changed
+    after that, so it can be handed to any number of requests while the next one is being built"""
+
+    def __init__(self, mode: str, user_ids: array, totals: array, guilds: int, built_at: float):
+        self.mode = mode
+        self.user_ids = user_ids    # sorted, so a user's total is a bisect away
+        self.totals = totals
+        self.guilds = guilds        # how many guilds went into it
+        self.built_at = built_at
+        self.ranks = RankIndex(zip(user_ids, totals))
+
+    def __len__(self):
+        return len(self.ranks)
+
+    def get(self, user_id: int):
+        """the user's global points, None if they have none"""
+        index = bisect_left(self.user_ids, user_id)
+        if index < len(self.user_ids) and self.user_ids[index] == user_id:
+            return self.totals[index]
+        return None
+
+    def position(self, user_id: int) -> int:
+        """1 based global position, -1 if the user isn't on it"""
+        points = self.get(user_id)
+        if points is None:
+            return -1
+        return self.ranks.rank(user_id, points) + 1
+
+    def page(self, page_requested: int, per_page: int) -> list[tuple[int, int, int]]:
+        """returns (1 based position, user id, points) for a 1 based page"""
+        start = per_page * (page_requested - 1)
+        return [
+            (position, user_id, points)
+            for position, (user_id, points) in enumerate(self.ranks.slice(start, start + per_page), start + 1)
+        ]
+
+    def total_pages(self, per_page: int) -> int:
+        return max(1, -(-len(self) // per_page))
@@ -0,0 +1,42 @@
+import time
+from collections import OrderedDict
+
+
+class IdleTracker:
+
+    """remembers when each guild's lazily loaded state was last used so cold guilds can be evicted.
+
+    a guild is due for eviction once it has been untouched for idle_seconds, or when more than max_loaded
+    guilds are loaded (least recently used first). the tracker only keeps the bookkeeping, the owner of the
+    state decides how to flush and drop it"""
+
+    def __init__(self, idle_seconds: float, max_loaded: int):
+        self.idle_seconds = idle_seconds
+        self.max_loaded = max_loaded
+        self.last_touched = OrderedDict() # guild id -> monotonic time, least recently used first
+
+    def touch(self, guild_id: int):
+        self.last_touched[guild_id] = time.monotonic()
+        self.last_touched.move_to_end(guild_id)
+
+    def forget(self, guild_id: int):
+        self.last_touched.pop(guild_id, None)
+
+    def touched_at(self, guild_id: int) -> float:
+        return self.last_touched.get(guild_id, 0)
+
+    def evictable(self, now: float = None) -> list[int]:
+        """returns the guilds to evict, coldest first"""
+        now = time.monotonic() if now is None else now
+        over_limit = len(self.last_touched) - self.max_loaded
+        evictable = []
+        for guild_id, touched in self.last_touched.items():
+            if over_limit > 0 or now - touched >= self.idle_seconds:
+                evictable.append(guild_id)
+                over_limit -= 1
+            else:
+                break # everything after this was touched more recently
+        return evictable
+
+    def __len__(self):
+        return len(self.last_touched)
@@ -0,0 +1,189 @@
+from bisect import bisect_right
+from collections import OrderedDict
+
+from components.function.logging import log
+
+TABLE_LEVELS = 1000 # thresholds precomputed per curve, levels past this are found by searching the curve itself
+POINTS_LIMIT = float(1 << 63) # points are stored as i64, so no threshold past this is ever needed
+
+
+class LevelCurve:
+
+    """maps points to levels and back. subclasses only define threshold(level), the total points needed to
+    reach a level (0 for level 0, strictly increasing after that).
+
+    the first TABLE_LEVELS thresholds are precomputed, so a level lookup is a bisect instead of a sqrt/log
+    per call and level crossings are just two bisects. negative points mirror positive ones, the way the
+    original quadratic formula behaved"""
+
+    name = None
+
+    def __init__(self):
+        self.table = [0.0]
+        for level in range(1, TABLE_LEVELS + 1):
+            threshold = float(self.threshold(level))
+            if not threshold > self.table[-1]:
+                raise ValueError(f"{self.name} curve thresholds have to keep increasing (level {level})")
+            self.table.append(threshold)
+            if threshold > POINTS_LIMIT:
+                break # nobody can get this far, the table covers every possible points value
+
+    def threshold(self, level: int) -> float:
+        raise NotImplementedError
+
+    def points_for(self, level: int) -> float:
+        """total points needed to reach a level. negative levels use the same thresholds as positive ones"""
+        level = abs(level)
+        if level < len(self.table):
+            return self.table[level]
+        return float(self.threshold(level))
+
+    def level_for(self, points) -> int:
+        magnitude = abs(points)
+        if magnitude < self.table[-1]:
+            level = bisect_right(self.table, magnitude) - 1
+        else:
+            level = self._search(magnitude)
+        return -level if points < 0 else level
+
+    def _search(self, magnitude) -> int:
+        """highest level whose threshold is <= magnitude, for points past the end of the table"""
+        low = len(self.table) - 1
+        high = low * 2
+        while self.points_for(high) <= magnitude:
+            low, high = high, high * 2
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.points_for(middle) <= magnitude:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def points_to_level(self, points) -> tuple[int, int]:
+        """returns level, remaining points to next level. same contract as basic.points_to_level"""
+        level = self.level_for(points)
+        return level, int(self.points_for(level + 1) - points)
+
+
+class QuadraticCurve(LevelCurve):
+
+    """the original curve, (level * k) ** 2"""
+
+    name = "quadratic"
+
+    def __init__(self, k: float):
+        self.k = k
+        super().__init__()
+
+    def threshold(self, level: int) -> float:
+        return (level * self.k) ** 2
+
+
+class LinearCurve(LevelCurve):
+
+    """every level costs the same, step points"""
+
+    name = "linear"
+
+    def __init__(self, step: float):
+        if step <= 0:
+            raise ValueError("linear curve step has to be positive")
+        self.step = step
+        super().__init__()
+
+    def threshold(self, level: int) -> float:
+        return level * self.step
+
+
+class ExponentialCurve(LevelCurve):
+
+    """level 1 costs base points and each level after costs growth_rate times the one before"""
+
+    name = "exponential"
+
+    def __init__(self, base: float, growth_rate: float):
+        if base <= 0 or growth_rate <= 1:
+            raise ValueError("exponential curve needs base > 0 and growth_rate > 1")
+        self.base = base
+        self.growth_rate = growth_rate
+        super().__init__()
+
+    def threshold(self, level: int) -> float:
+        try:
+            return self.base * (self.growth_rate ** level - 1) / (self.growth_rate - 1)
+        except OverflowError:
+            return float("inf")
+
+
+class TableCurve(LevelCurve):
+
+    """admin-provided thresholds for level 1, 2, 3..., continuing past the end with the last level's cost"""
+
+    name = "table"
+
+    def __init__(self, thresholds: list):
+        if not thresholds:
+            raise ValueError("table curve needs at least one threshold")
+        self.thresholds = [0] + [float(points) for points in thresholds]
+        self.last_step = self.thresholds[-1] - self.thresholds[-2]
+        super().__init__()
+
+    def threshold(self, level: int) -> float:
+        if level < len(self.thresholds):
+            return self.thresholds[level]
+        return self.thresholds[-1] + (level - len(self.thresholds) + 1) * self.last_step
+
+
+# curves are immutable, so guilds with the same settings share one. keyed by everything the curve depends on,
+# which means changing k or the curve settings picks up a new curve and nothing else ever rebuilds one. only
+# consulted when a guild's config changes (see basic.get_curve), and the least recently used go past
+# CURVE_CACHE_SIZE so admins trying out settings can't grow it forever
+CURVE_CACHE_SIZE = 256
+_curves = OrderedDict()
+
+CURVE_SETTINGS = ("level_curve", "k", "base", "growth_rate", "level_table") # config attributes curves read
+CURVE_PARAMETERS = { # settings each curve can't do without
+    "quadratic": (),
+    "linear": ("base",),
+    "exponential": ("base", "growth_rate"),
+    "table": ("level_table",),
+}
+
+def curve_key(config: dict, k_fallback: float) -> tuple:
+    curve = config.get("level_curve", "quadratic")
+    if curve == "linear":
+        return (curve, config.get("base"))
+    if curve == "exponential":
+        return (curve, config.get("base"), config.get("growth_rate"))
+    if curve == "table":
+        return (curve, tuple(config.get("level_table") or ()))
+    k = config.get("k", k_fallback)
+    return ("quadratic", k_fallback if k == 0 else k)
+
+def build_curve(key: tuple) -> LevelCurve:
+    curve = key[0]
+    if curve == "linear":
+        return LinearCurve(key[1])
+    if curve == "exponential":
+        return ExponentialCurve(key[1], key[2])
+    if curve == "table":
+        return TableCurve(list(key[1]))
+    return QuadraticCurve(key[1])
+
+def get_curve(config: dict, k_fallback: float) -> LevelCurve:
+    """returns the (cached) curve described by the CURVE_SETTINGS of a levels config"""
+    key = curve_key(config, k_fallback)
+    curve = _curves.get(key)
+    if curve is not None:
+        _curves.move_to_end(key)
+        return curve
+    try:
+        curve = build_curve(key)
+    except (TypeError, ValueError) as e:
+        log(f"~1invalid level curve {key}, using the default: {e}")
+        curve = get_curve({}, k_fallback)
+    _curves[key] = curve
+    while len(_curves) > CURVE_CACHE_SIZE:
+        _curves.popitem(last=False)
+    return curve
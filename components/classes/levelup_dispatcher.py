@@ -0,0 +1,111 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+import aiohttp
+
+from components.function.logging import log
+
+
+def is_transient(error: Exception) -> bool:
+    """whether an error from a discord call is network trouble worth retrying. rate limits and server errors
+    aren't, discord.py already retries those itself"""
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError, ConnectionError))
+
+async def with_retries(call, *args, attempts: int = 4, base_delay: float = 1, **kwargs):
+    """awaits call(*args, **kwargs), retrying transient errors with exponential backoff and jitter. anything
+    else, or the last transient error, is raised as usual.
+
+    only use it for idempotent calls (like add_roles). a send that timed out may still have gone through, so
+    retrying it can post the message twice"""
+    for attempt in range(attempts):
+        try:
+            return await call(*args, **kwargs)
+        except Exception as e:
+            if attempt == attempts - 1 or not is_transient(e):
+                raise
+            delay = base_delay * 2 ** attempt * (1 + random.random())
+            log(f"~3{getattr(call, '__qualname__', call)} failed ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+class LevelUpDispatcher:
+
+    """runs level up announcements (role adds, DMs, channel messages) on a fixed number of worker coroutines.
+
+    submit() never waits. announcements waiting for a worker are kept per (guild, user) and a newer level
+    replaces the pending one, so someone who crosses several levels before their turn comes gets one
+    announcement for the highest. a (guild, user) is never announced by two workers at once, one submitted
+    while its last announcement is still running waits for that to finish. handle(guild, member, level) is
+    expected to wrap its idempotent discord calls in with_retries, anything it raises is logged and dropped.
+
+    stats() reports the queue depth and how long announcements took from submit to done"""
+
+    def __init__(self, handle, workers: int = 4, latency_samples: int = 200):
+        self.handle = handle
+        self.workers = workers
+        self.pending = {}           # (guild id, user id) -> (guild, member, level, submitted at)
+        self.order = asyncio.Queue() # keys of self.pending that aren't in flight, oldest first
+        self.in_flight = set()       # keys a worker is announcing right now
+        self.latencies = deque(maxlen=latency_samples)
+        self.processed = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.busy = 0
+        self.tasks = []
+
+    def submit(self, guild, member, level: int):
+        key = (guild.id, member.id)
+        previous = self.pending.get(key)
+        if previous is not None:
+            self.coalesced += 1
+            # keep the place in the queue and the original submit time, only the level moves on
+            self.pending[key] = (guild, member, max(level, previous[2]), previous[3])
+            return
+        self.pending[key] = (guild, member, level, time.monotonic())
+        if key not in self.in_flight: # otherwise it's queued once the running one is done
+            self.order.put_nowait(key)
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        if any(not task.done() for task in self.tasks):
+            return
+        self.tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+
+    async def _work(self):
+        while True:
+            key = await self.order.get()
+            guild, member, level, submitted_at = self.pending.pop(key)
+            self.in_flight.add(key)
+            self.busy += 1
+            try:
+                await self.handle(guild, member, level)
+            except Exception as e:
+                self.failed += 1
+                log(f"~1failed to announce level {level} for {member.name} in {guild.name}: {e}")
+            finally:
+                self.busy -= 1
+                self.processed += 1
+                self.latencies.append(time.monotonic() - submitted_at)
+                self.in_flight.discard(key)
+                if key in self.pending:
+                    self.order.put_nowait(key)
+
+    def __len__(self):
+        return len(self.pending)
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "queued": len(self.pending),
+            "busy": self.busy,
+            "processed": self.processed,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "latency_avg": sum(latencies) / len(latencies) if latencies else None,
+            "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else None,
+        }
@@ -0,0 +1,28 @@
+from collections import namedtuple
+
+from components.classes.confighandler import ConfigHandler
+
+
+class MessagePolicy(namedtuple("MessagePolicy", ["enabled", "disabled_channels", "points_range", "message_cooldown", "confighandler", "config_version"])):
+
+    """everything on_message needs before awarding points, compiled once from a guild's levels config.
+
+    it is immutable, so a message only costs a dict lookup and a version check. it goes stale when the
+    config it was compiled from changes (ConfigHandler.version) and is dropped by the Levels cog when the
+    module is toggled or the config is evicted"""
+
+    __slots__ = ()
+
+    @classmethod
+    def compile(cls, confighandler: ConfigHandler, enabled: bool = True) -> "MessagePolicy":
+        return cls(
+            enabled=enabled,
+            disabled_channels=frozenset(confighandler.get_attribute("disabled_channels", fallback=[]) or ()),
+            points_range=tuple(confighandler.get_attribute("points_range", fallback=(1, 5))),
+            message_cooldown=confighandler.get_attribute("message_cooldown", fallback=30),
+            confighandler=confighandler,
+            config_version=confighandler.version,
+        )
+
+    def stale(self) -> bool:
+        return self.confighandler.version != self.config_version
@@ -0,0 +1,135 @@
+import os
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+
+from components.function.logging import log
+
+
+class PointsJournal:
+
+    """append-only journal of points changes on top of a compacted per-guild snapshot.
+
+    every flush appends one "user_id points" line per changed user and fsyncs, so write cost follows message
+    volume instead of guild size. records hold absolute values rather than deltas, which keeps replaying them
+    idempotent if we crash halfway through a compaction.
+
+    compaction renames <guild>.journal to <guild>.journal.compacting, writes the new snapshot and then deletes
+    the .compacting file. loading replays .compacting and then .journal on top of the snapshot.
+
+    all file work goes through self.executor, which must be single threaded, so appends and compactions for a
+    guild can never overtake each other."""
+
+    def __init__(self, directory: str, load_snapshot, save_snapshot, compact_bytes: int = 1024 * 1024, executor=None):
+        self.directory = directory
+        self.load_snapshot = load_snapshot  # load_snapshot(guild_id) -> dict (or another mutable mapping) or None
+        self.save_snapshot = save_snapshot  # save_snapshot(guild_id, {user_id: points})
+        self.compact_bytes = compact_bytes
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="points-journal")
+        self.sizes = {} # guild id -> bytes written to the journal since the last compaction
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def journal_path(self, guild_id: int) -> str:
+        return os.path.join(self.directory, f"{guild_id}.journal")
+
+    def compacting_path(self, guild_id: int) -> str:
+        return os.path.join(self.directory, f"{guild_id}.journal.compacting")
+
+    # WRITING ==========================================================================================================
+
+    def append(self, guild_id: int, changes: dict):
+        """appends absolute point values for the changed users and fsyncs. runs on the executor"""
+        if not changes:
+            return
+        data = "".join(f"{int(user_id)} {int(points)}\n" for user_id, points in changes.items()).encode("ascii")
+        with open(self.journal_path(guild_id), "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.sizes[guild_id] = self.sizes.get(guild_id, 0) + len(data)
+
+    def needs_compaction(self, guild_id: int) -> bool:
+        return self.sizes.get(guild_id, 0) >= self.compact_bytes
+
+    def compact(self, guild_id: int, changes: dict, snapshot: dict):
+        """folds the journal into a new snapshot. runs on the executor.
+
+        changes are the guild's unflushed changes and snapshot is a copy of its points, both taken at the same
+        moment, so the snapshot covers everything that ends up in the rotated journal"""
+        self.append(guild_id, changes)
+
+        journal_path = self.journal_path(guild_id)
+        compacting_path = self.compacting_path(guild_id)
+
+        if os.path.exists(compacting_path):
+            # an earlier compaction died before finishing, keep its records in front of ours
+            if os.path.exists(journal_path):
+                with open(journal_path, "rb") as src, open(compacting_path, "ab") as dst:
+                    dst.write(src.read())
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.remove(journal_path)
+        elif os.path.exists(journal_path):
+            os.replace(journal_path, compacting_path)
+
+        self.save_snapshot(guild_id, snapshot)
+
+        if os.path.exists(compacting_path):
+            os.remove(compacting_path)
+        self.sizes[guild_id] = 0
+
+    # READING ==========================================================================================================
+
+    def replay(self, path: str, points: dict, repair: bool = True) -> int:
+        """applies the records in a journal file to points, returns the number of records applied. with repair
+        a torn record at the end is cut off the file, without it it's only skipped"""
+        if not os.path.exists(path):
+            return 0
+        applied = 0
+        good_bytes = 0
+        torn = False
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    torn = True # torn write at the very end of the file, everything before it is good
+                    break
+                good_bytes += len(line)
+                try:
+                    user_id, user_points = line.split()
+                    points[int(user_id)] = int(user_points)
+                except ValueError:
+                    continue
+                applied += 1
+        if torn and repair:
+            # cut it off so the next append doesn't get glued onto the partial record
+            os.truncate(path, good_bytes)
+            log(f"~3dropped a torn record at the end of {path}")
+        return applied
+
+    def load(self, guild_id: int) -> dict:
+        """returns a guild's points: the last snapshot with any journalled changes replayed on top"""
+        points = self.load_snapshot(guild_id)
+        if not isinstance(points, MutableMapping):
+            points = {}
+
+        applied = self.replay(self.compacting_path(guild_id), points)
+        applied += self.replay(self.journal_path(guild_id), points)
+        if applied:
+            log(f"~2replayed {applied} journalled points changes for guild {guild_id}")
+
+        self.sizes[guild_id] = sum(
+            os.path.getsize(path)
+            for path in (self.journal_path(guild_id), self.compacting_path(guild_id))
+            if os.path.exists(path)
+        )
+        return points
+
+    def read(self, guild_id: int) -> dict:
+        """same as load, but never changes a file or the journal's bookkeeping, so it can run off the executor.
+        a guild being written to at the same time may be read a few changes behind"""
+        points = self.load_snapshot(guild_id)
+        if not isinstance(points, MutableMapping):
+            points = {}
+        self.replay(self.compacting_path(guild_id), points, repair=False)
+        self.replay(self.journal_path(guild_id), points, repair=False)
+        return points
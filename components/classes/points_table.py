@@ -0,0 +1,170 @@
+import time
+from collections.abc import Mapping, MutableMapping
+
+from components.classes.rank_index import RankIndex
+from components.classes.topk_tracker import TopKTracker
+
+
+class PointsTable(MutableMapping):
+
+    """a guild's live points with a version counter and copy-on-write snapshots.
+
+    snapshot() hands out the current dict (or CompactPoints) read-only and marks it shared, which is O(1).
+    the next write copies it before changing anything, so a snapshot never changes under a worker thread that
+    is serialising it, and the event loop never pauses to copy a guild that isn't being written to. the one
+    exception is a CompactPoints with unmerged changes, which is merged first (into new arrays, so a previous
+    snapshot is never disturbed) at the cost of one merge.
+    version goes up on every write, so anything derived from the points can tell whether it is stale. merging
+    changes no values, so it doesn't count as one.
+
+    the rank index (and the top k tracker for position roles) are built the first time someone asks for them
+    and kept up to date by every write after that. the index holds every ranked user again as python ints, so
+    drop_cold_ranks() lets it go once nobody has asked for it in a while. if an active member set is attached, only its members are
+    ranked, so people who left the guild keep their points but take up no leaderboard positions"""
+
+    def __init__(self, data=None):
+        self.data = {} if data is None else data # dict or CompactPoints
+        self.version = 0
+        self.shared = False # True while the current data object is held by a snapshot
+        self.rank_index = None
+        self.ranks_used_at = 0.0 # time.monotonic() of the last ranks() call
+        self.top_k = None
+        self.active = None # set of user ids still in the guild, None ranks everyone
+
+    def _writable(self):
+        if self.shared:
+            self.data = self.data.copy()
+            self.shared = False
+        self.version += 1
+        return self.data
+
+    def snapshot(self) -> "PointsSnapshot":
+        """immutable point-in-time view of the points, safe to read from another thread"""
+        if getattr(self.data, "overlay", None):
+            # CompactPoints merges lazily, do it now so nothing touches the shared arrays later. a shared one
+            # may still be read by an older snapshot, so that gets a merged copy instead
+            if self.shared:
+                self.data = self.data.merged()
+            else:
+                self.data.merge()
+        self.shared = True
+        return PointsSnapshot(self.data, self.version)
+
+    def ranks(self) -> RankIndex:
+        self.ranks_used_at = time.monotonic()
+        if self.rank_index is None:
+            if self.active is None:
+                self.rank_index = RankIndex(self.data)
+            else:
+                active = self.active
+                self.rank_index = RankIndex((user_id, points) for user_id, points in self.data.items() if user_id in active)
+        return self.rank_index
+
+    def drop_cold_ranks(self, idle_seconds: float) -> bool:
+        """drops the rank index if it hasn't been used for idle_seconds, returns whether it was dropped"""
+        if self.rank_index is None or time.monotonic() - self.ranks_used_at < idle_seconds:
+            return False
+        self.rank_index = None # rebuilt on next use
+        if self.top_k is not None:
+            self.top_k.stale = True
+        return True
+
+    def is_ranked(self, user_id: int) -> bool:
+        return self.active is None or user_id in self.active
+
+    def set_active(self, active: set):
+        self.active = active
+        self.rank_index = None # rebuilt on next use
+        if self.top_k is not None:
+            self.top_k.stale = True
+
+    def activate(self, user_id: int):
+        """a member (re)joined, rank them again if they have points"""
+        if self.active is None or user_id in self.active:
+            return
+        self.active.add(user_id)
+        points = self.data.get(user_id)
+        if points is not None and self.rank_index is not None:
+            self.rank_index.add(user_id, points)
+        if points is not None and self.top_k is not None:
+            self.top_k.observe(user_id, points)
+
+    def deactivate(self, user_id: int):
+        """a member left, stop ranking them but keep their points"""
+        if self.active is None or user_id not in self.active:
+            return
+        self.active.discard(user_id)
+        points = self.data.get(user_id)
+        if points is not None and self.rank_index is not None:
+            self.rank_index.discard(user_id, points)
+        if points is not None and self.top_k is not None:
+            self.top_k.observe(user_id, None)
+
+    def track_top(self, k: int) -> TopKTracker:
+        if self.top_k is None:
+            self.top_k = TopKTracker(k)
+        self.top_k.resize(k)
+        return self.top_k
+
+    def __getitem__(self, user_id):
+        return self.data[user_id]
+
+    def __setitem__(self, user_id, value):
+        old_value = self.data.get(user_id)
+        data = self._writable()
+        data[user_id] = value
+        if not self.is_ranked(user_id):
+            return
+        if self.rank_index is not None:
+            self.rank_index.move(user_id, old_value, data[user_id])
+        if self.top_k is not None:
+            self.top_k.observe(user_id, data[user_id])
+
+    def __delitem__(self, user_id):
+        old_value = self.data[user_id]
+        del self._writable()[user_id]
+        if not self.is_ranked(user_id):
+            return
+        if self.rank_index is not None:
+            self.rank_index.discard(user_id, old_value)
+        if self.top_k is not None:
+            self.top_k.observe(user_id, None)
+
+    def __contains__(self, user_id):
+        return user_id in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, user_id, default=None):
+        return self.data.get(user_id, default)
+
+    def items(self):
+        return self.data.items()
+
+
+class PointsSnapshot(Mapping):
+
+    """read-only view of a PointsTable at one version"""
+
+    def __init__(self, data, version: int):
+        self.data = data
+        self.version = version
+
+    def __getitem__(self, user_id):
+        return self.data[user_id]
+
+    def __contains__(self, user_id):
+        return user_id in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def items(self):
+        return self.data.items()
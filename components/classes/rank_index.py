@@ -0,0 +1,200 @@
+import sys
+from bisect import bisect_left, bisect_right, insort
+
+# keys pack (-points, user id) into one int so they sort by points high to low, then by user id, and compare
+# as fast as any other int. points have to fit in an i64 like they do in the binary snapshot
+_USER_MASK = (1 << 64) - 1
+_POINTS_MAX = (1 << 63) - 1
+
+def make_key(user_id: int, points: int) -> int:
+    return ((_POINTS_MAX - int(points)) << 64) | user_id
+
+def split_key(key: int) -> tuple[int, int]:
+    """returns (user id, points)"""
+    return key & _USER_MASK, _POINTS_MAX - (key >> 64)
+
+
+class RankIndex:
+
+    """order statistics over a guild's points: rank of a user, the user at a rank and leaderboard slices in
+    O(log n), kept up to date one change at a time so the leaderboard never has to be re-sorted.
+
+    keys live in a list of sorted buckets of roughly load_factor keys each (insertions only shift one small
+    bucket). a fenwick tree over the bucket sizes turns a position into a bucket and an offset, and a bucket
+    into the number of keys before it"""
+
+    def __init__(self, points=None, load_factor: int = 512):
+        self.load_factor = load_factor
+        self.buckets = []   # sorted lists of keys, every key in a bucket is smaller than every key in the next
+        self.maxes = []     # last key of each bucket
+        self.tree = [0]     # fenwick tree over len(bucket), 1 indexed
+        self.size = 0
+        if points:
+            self.rebuild(points)
+
+    def rebuild(self, points):
+        """replaces the contents with points, {user id: points} or an iterable of (user id, points)"""
+        items = points.items() if hasattr(points, "items") else points
+        keys = sorted(make_key(user_id, user_points) for user_id, user_points in items)
+        self.buckets = [keys[i:i + self.load_factor] for i in range(0, len(keys), self.load_factor)]
+        self.maxes = [bucket[-1] for bucket in self.buckets]
+        self.size = len(keys)
+        self._rebuild_tree()
+
+    # FENWICK TREE =====================================================================================================
+
+    def _rebuild_tree(self):
+        tree = [0] + [len(bucket) for bucket in self.buckets]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def _tree_add(self, bucket_index: int, amount: int):
+        i = bucket_index + 1
+        while i < len(self.tree):
+            self.tree[i] += amount
+            i += i & -i
+
+    def _keys_before(self, bucket_index: int) -> int:
+        """number of keys in the buckets before bucket_index"""
+        total = 0
+        i = bucket_index
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, position: int) -> tuple[int, int]:
+        """returns (bucket index, offset in the bucket) of the key at position"""
+        bucket_index = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            next_index = bucket_index + step
+            if next_index < len(self.tree) and self.tree[next_index] <= position:
+                position -= self.tree[next_index]
+                bucket_index = next_index
+            step >>= 1
+        return bucket_index, position
+
+    # UPDATES ==========================================================================================================
+
+    def _insert(self, key: int):
+        if not self.buckets:
+            self.buckets.append([key])
+            self.maxes.append(key)
+            self.size = 1
+            self._rebuild_tree()
+            return
+
+        bucket_index = bisect_left(self.maxes, key)
+        if bucket_index == len(self.maxes):
+            bucket_index -= 1 # bigger than everything, goes on the end of the last bucket
+        bucket = self.buckets[bucket_index]
+        insort(bucket, key)
+        self.maxes[bucket_index] = bucket[-1]
+        self.size += 1
+
+        if len(bucket) > self.load_factor * 2:
+            half = len(bucket) // 2
+            self.buckets[bucket_index:bucket_index + 1] = [bucket[:half], bucket[half:]]
+            self.maxes[bucket_index:bucket_index + 1] = [bucket[half - 1], bucket[-1]]
+            self._rebuild_tree()
+        else:
+            self._tree_add(bucket_index, 1)
+
+    def _remove(self, key: int) -> bool:
+        bucket_index = bisect_left(self.maxes, key)
+        if bucket_index == len(self.maxes):
+            return False
+        bucket = self.buckets[bucket_index]
+        i = bisect_left(bucket, key)
+        if i == len(bucket) or bucket[i] != key:
+            return False
+        del bucket[i]
+        self.size -= 1
+
+        if not bucket:
+            del self.buckets[bucket_index]
+            del self.maxes[bucket_index]
+            self._rebuild_tree()
+        else:
+            self.maxes[bucket_index] = bucket[-1]
+            self._tree_add(bucket_index, -1)
+        return True
+
+    def add(self, user_id: int, points: int):
+        self._insert(make_key(user_id, points))
+
+    def discard(self, user_id: int, points: int):
+        self._remove(make_key(user_id, points))
+
+    def move(self, user_id: int, old_points, new_points: int):
+        """records a user's points going from old_points (None if they weren't ranked) to new_points"""
+        if old_points is not None:
+            if old_points == new_points:
+                return
+            self._remove(make_key(user_id, old_points))
+        self._insert(make_key(user_id, new_points))
+
+    # QUERIES ==========================================================================================================
+
+    def __len__(self):
+        return self.size
+
+    def rank(self, user_id: int, points: int) -> int:
+        """0 based position of a user with the given points, or -1 if they aren't in the index"""
+        key = make_key(user_id, points)
+        bucket_index = bisect_left(self.maxes, key)
+        if bucket_index == len(self.maxes):
+            return -1
+        bucket = self.buckets[bucket_index]
+        i = bisect_left(bucket, key)
+        if i == len(bucket) or bucket[i] != key:
+            return -1
+        return self._keys_before(bucket_index) + i
+
+    def count_at_least(self, points: int) -> int:
+        """number of users with points >= points, they're always the first ones in the index"""
+        key = make_key(_USER_MASK, points) # sorts after everyone else on the same points
+        bucket_index = bisect_right(self.maxes, key)
+        if bucket_index == len(self.maxes):
+            return self.size
+        return self._keys_before(bucket_index) + bisect_right(self.buckets[bucket_index], key)
+
+    def at(self, position: int) -> tuple[int, int]:
+        """(user id, points) at a 0 based position"""
+        if not 0 <= position < self.size:
+            raise IndexError(position)
+        bucket_index, offset = self._locate(position)
+        return split_key(self.buckets[bucket_index][offset])
+
+    def slice(self, start: int, stop: int) -> list[tuple[int, int]]:
+        """(user id, points) for positions start to stop (exclusive), highest points first"""
+        start = max(start, 0)
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+        bucket_index, offset = self._locate(start)
+        entries = []
+        remaining = stop - start
+        while remaining > 0:
+            keys = self.buckets[bucket_index][offset:offset + remaining]
+            entries.extend(split_key(key) for key in keys)
+            remaining -= len(keys)
+            bucket_index += 1
+            offset = 0
+        return entries
+
+    def top(self, k: int) -> list[tuple[int, int]]:
+        return self.slice(0, k)
+
+    # MEMORY ===========================================================================================================
+
+    def memory_usage(self) -> int:
+        """bytes held by the buckets and their keys. keys are all about the same size, so one per bucket is measured"""
+        size = sys.getsizeof(self.buckets) + sys.getsizeof(self.maxes) + sys.getsizeof(self.tree)
+        for bucket in self.buckets:
+            size += sys.getsizeof(bucket) + len(bucket) * sys.getsizeof(bucket[0])
+        return size
@@ -0,0 +1,33 @@
+from bisect import bisect_right
+
+from components.classes.confighandler import ConfigHandler
+
+
+class RewardTiers:
+
+    """a guild's level role rewards ({level: role id} from the levels config) as parallel arrays sorted by
+    level, so the rewards for a level are a bisect away instead of a walk over every level below it.
+
+    like MessagePolicy it goes stale when the config it was compiled from changes (ConfigHandler.version)"""
+
+    def __init__(self, confighandler: ConfigHandler):
+        rewards = confighandler.get_attribute("levels", fallback=None)
+        tiers = sorted((int(level), role_id) for level, role_id in (rewards or {}).items() if int(level) > 0)
+        self.levels = [level for level, _ in tiers]
+        self.role_ids = [role_id for _, role_id in tiers]
+        self.confighandler = confighandler
+        self.config_version = confighandler.version
+
+    def __len__(self):
+        return len(self.levels)
+
+    def stale(self) -> bool:
+        return self.confighandler.version != self.config_version
+
+    def owed(self, level: int, role_ids) -> list[tuple[int, int]]:
+        """(level, role id) of the rewards at or below level whose role isn't in role_ids (the member's roles)"""
+        earned = bisect_right(self.levels, level)
+        missing = set(self.role_ids[:earned]).difference(role_ids)
+        if not missing:
+            return []
+        return [(tier_level, role_id) for tier_level, role_id in zip(self.levels[:earned], self.role_ids[:earned]) if role_id in missing]
@@ -0,0 +1,40 @@
+class TopKTracker:
+
+    """remembers who holds the top k leaderboard positions of a guild and notices when that changes.
+
+    every points change is passed to observe(), which is O(1): a change can only move the top k if the user is
+    already in it, or now has at least as many points as the k-th holder. only then is the tracker marked
+    stale, and refresh() re-reads the top k from the rank index and reports whether the holders changed"""
+
+    def __init__(self, k: int):
+        self.k = k
+        self.holders = ()       # user ids in leaderboard order, at most k of them
+        self.holder_set = set()
+        self.threshold = None   # points of the k-th holder, None while fewer than k users have points
+        self.stale = True
+
+    def resize(self, k: int):
+        if k != self.k:
+            self.k = k
+            self.stale = True
+
+    def observe(self, user_id: int, points):
+        """records a points change, points is None if the user was removed"""
+        if self.stale:
+            return
+        if user_id in self.holder_set or self.threshold is None or (points is not None and points >= self.threshold):
+            self.stale = True
+
+    def refresh(self, ranks) -> bool:
+        """brings the holders up to date from a RankIndex, returns True if they changed"""
+        if not self.stale:
+            return False
+        top = ranks.top(self.k)
+        holders = tuple(user_id for user_id, _ in top)
+        changed = holders != self.holders
+
+        self.holders = holders
+        self.holder_set = set(holders)
+        self.threshold = top[-1][1] if len(top) == self.k else None
+        self.stale = False
+        return changed
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+from components.function.logging import log
+
+
+class WriteBehind:
+
+    """write-behind buffer for per-guild user data (points). records which guilds and users changed since
+    the last flush so only those are persisted, and idle guilds cost no i/o at all.
+
+    a dirty guild is flushed once it has been quiet for flush_interval seconds, or once its oldest
+    unflushed change is max_staleness seconds old, whichever comes first"""
+
+    def __init__(self, persist, flush_interval: float = 5, max_staleness: float = 30, executor=None):
+        self.persist = persist # called as persist(guild_id, {user_id: value}) in a worker thread
+        self.executor = executor # None uses the event loop's default executor
+        self.flush_interval = flush_interval
+        self.max_staleness = max_staleness
+
+        self.dirty = {}             # guild id -> set of user ids changed since the last flush
+        self.first_dirtied = {}     # guild id -> time of the oldest unflushed change
+        self.last_dirtied = {}      # guild id -> time of the newest unflushed change
+
+    def mark_dirty(self, guild_id: int, user_id: int):
+        now = time.monotonic()
+        users = self.dirty.get(guild_id)
+        if users is None:
+            users = self.dirty[guild_id] = set()
+            self.first_dirtied[guild_id] = now
+        users.add(user_id)
+        self.last_dirtied[guild_id] = now
+
+    def is_dirty(self, guild_id: int) -> bool:
+        return guild_id in self.dirty
+
+    def due_guilds(self, now: float = None) -> list[int]:
+        """returns the dirty guilds that should be flushed now"""
+        now = time.monotonic() if now is None else now
+        due = []
+        for guild_id in self.dirty:
+            quiet = now - self.last_dirtied[guild_id] >= self.flush_interval
+            stale = now - self.first_dirtied[guild_id] >= self.max_staleness
+            if quiet or stale:
+                due.append(guild_id)
+        return due
+
+    def take(self, guild_id: int, source: dict) -> dict:
+        """clears a guild's dirty set and returns a copy of the changed values from source"""
+        users = self.dirty.pop(guild_id, set())
+        self.first_dirtied.pop(guild_id, None)
+        self.last_dirtied.pop(guild_id, None)
+
+        guild_data = source.get(guild_id, {})
+        return {user_id: guild_data[user_id] for user_id in users if user_id in guild_data}
+
+    async def flush_guild(self, guild_id: int, source: dict):
+        # the copy is taken on the event loop so the worker thread never sees a dict that is being mutated
+        changes = self.take(guild_id, source)
+        if not changes:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.persist, guild_id, changes)
+        except Exception as e:
+            log(f"~1failed to persist {len(changes)} changes for guild {guild_id}: {e}")
+            for user_id in changes: # try again next time round
+                self.mark_dirty(guild_id, user_id)
+
+    async def flush(self, source: dict, force: bool = False):
+        """flushes every due guild, or every dirty guild if force is set"""
+        guild_ids = list(self.dirty) if force else self.due_guilds()
+        for guild_id in guild_ids:
+            await self.flush_guild(guild_id, source)
+
+    async def run(self, source: dict):
+        """flush loop, checks for due guilds every flush_interval seconds"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush(source)
@@ -0,0 +1,91 @@
+import asyncio
+
+from components.function.logging import log
+
+
+class XPPipeline:
+
+    """takes points awards off the gateway handler.
+
+    on_message only submit()s (guild, member, points), which never waits. one consumer drains whatever has
+    queued up since its last pass (up to max_batch awards), adds up each user's awards per guild and hands
+    every guild's awards to apply_awards(guild, {user id: (member, points)}) in one go. that returns the
+    (member, new level) of everyone who levelled up, which are passed on to level_ups.submit() (see
+    LevelUpDispatcher) so slow role edits and DMs never hold up points. apply_awards should hand position role
+    updates off to a task of their own for the same reason.
+
+    if more than max_pending awards are waiting, new ones are dropped and counted rather than letting a
+    message storm grow the queue without bound"""
+
+    def __init__(self, apply_awards, level_ups, max_batch: int = 1000, max_pending: int = 50_000):
+        self.apply_awards = apply_awards
+        self.level_ups = level_ups
+        self.max_batch = max_batch
+        self.awards = asyncio.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self.full = False # logged once per overflow instead of once per dropped message
+        self.tasks = []
+
+    def submit(self, guild, member, amount: int) -> bool:
+        try:
+            self.awards.put_nowait((guild, member, amount))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if not self.full:
+                self.full = True
+                log(f"~3points queue is full ({self.awards.qsize()} awards), dropping new ones until it drains")
+            return False
+        self.full = False
+        return True
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        if any(not task.done() for task in self.tasks):
+            return
+        self.tasks = [loop.create_task(self._consume_awards())]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+
+    async def drain(self):
+        """applies every award still queued, for shutdown"""
+        while not self.awards.empty():
+            await self._apply(self._take_batch(self.awards.get_nowait()))
+
+    def _take_batch(self, first) -> dict:
+        """{guild id: (guild, {user id: (member, points)})} from first plus whatever else is queued"""
+        batch = {}
+        item = first
+        taken = 1
+        while True:
+            guild, member, amount = item
+            if guild.id not in batch:
+                batch[guild.id] = (guild, {})
+            guild_awards = batch[guild.id][1]
+            previous = guild_awards.get(member.id)
+            guild_awards[member.id] = (member, amount + (previous[1] if previous else 0))
+
+            if taken >= self.max_batch:
+                return batch
+            try:
+                item = self.awards.get_nowait()
+            except asyncio.QueueEmpty:
+                return batch
+            taken += 1
+
+    async def _apply(self, batch: dict):
+        for guild, awards in batch.values():
+            try:
+                level_ups = await self.apply_awards(guild, awards)
+            except Exception as e:
+                log(f"~1failed to apply {len(awards)} points awards in guild {guild.id}: {e}")
+                continue
+            for member, level in level_ups:
+                self.level_ups.submit(guild, member, level)
+
+    async def _consume_awards(self):
+        while True:
+            await self._apply(self._take_batch(await self.awards.get()))
+
+    def stats(self) -> dict:
+        return {"pending_awards": self.awards.qsize(), "dropped": self.dropped}
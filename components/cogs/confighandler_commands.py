@@ -6,7 +6,7 @@ import yaml
 from components.shared_instances import shcogs
 from components.function.logging import log
 from components.function.api_shorthand import sync_cogs_for_guild
-from components.function.savedata import get_guild_attribute, set_guild_attribute
+from components.function.savedata import aget_guild_attribute, aset_guild_attribute
 from components.classes.confighandler import ConfigHandler, register_config, COG_LABELS
 
 class ConfigHandlerCommands(commands.Cog):
@@ -23,7 +23,7 @@ class ConfigHandlerCommands(commands.Cog):
         module="name of the module to toggle (enable/disable)"
     )
     async def toggle_module(self, interaction: discord.Interaction, module: str):
-        disabled = get_guild_attribute(interaction.guild.id, "disabled_cogs") or []
+        disabled = await aget_guild_attribute(interaction.guild.id, "disabled_cogs") or []
 
         if module not in shcogs:
             await interaction.response.send_message(
@@ -48,7 +48,8 @@ class ConfigHandlerCommands(commands.Cog):
         )
         msg = await interaction.original_response()
 
-        set_guild_attribute(interaction.guild.id, "disabled_cogs", disabled)
+        await aset_guild_attribute(interaction.guild.id, "disabled_cogs", disabled)
+        interaction.client.dispatch("module_toggled", interaction.guild, module, action == "enabled")
         await sync_cogs_for_guild(interaction.client, interaction.client.tree, interaction.guild)
         log(f"{action} {module} module for server {interaction.guild.name}")
 
@@ -7,69 +7,240 @@ import re
 from datetime import datetime, timezone
 
 from components.function.logging import log
-from components.function.savedata import set_guild_attribute, get_guild_attribute, get_guild_member_attribute, set_guild_member_attribute
+from components.function.savedata import aget_guild_attribute, aget_guild_member_attribute, aset_guild_member_attribute, aget_member_table, aevict_idle_member_tables, get_cache_stats
 from components.classes.confighandler import ConfigHandler, register_config
-from components.shared_instances import POINTS_DATABASE, DEVTAG, shcogs
+from components.classes.idle_tracker import IdleTracker
+from components.function.levels.leaderboard_view import LeaderboardView
+from components.classes.message_policy import MessagePolicy
+from components.classes.cooldown_tracker import CooldownTracker
+from components.classes.xp_pipeline import XPPipeline
+from components.classes.levelup_dispatcher import LevelUpDispatcher, with_retries
+from components.classes.reward_tiers import RewardTiers
+from components.shared_instances import POINTS_DATABASE, POINTS_COMPACT_INTERVAL, GUILD_IDLE_SECONDS, GUILD_MAX_LOADED, GUILD_EVICT_INTERVAL, PRUNE_DEPARTED_INTERVAL, POSITION_ROLES_RECONCILE_INTERVAL, MEMORY_REPORT_INTERVAL, GLOBAL_LEADERBOARD_INTERVAL, XP_BATCH_SIZE, XP_QUEUE_MAX, LEVELUP_WORKERS, DEVTAG, shcogs
 import components.function.levels.basic as lvbsc
 import components.function.levels.leaderboard as lvlb
 import components.function.levels.rank_card as lvrc
+import components.function.levels.level_engine as lvengine
+import components.function.levels.global_leaderboard as lvglobal
+import components.classes.level_curve as level_curve
 
-recent_speakers = {}
-_position_role_update_cooldowns = {}
+async def save_points_regular():
+    # only guilds/users touched since the last flush are written, see WriteBehind
+    await lvbsc.points_writer.run(POINTS_DATABASE)
 
-async def save_points_regular(interval=5):
+async def compact_points_regular(interval=POINTS_COMPACT_INTERVAL):
     while True:
         await asyncio.sleep(interval)
-        for guild_id, data in POINTS_DATABASE.items():
-            if data:
-                set_guild_attribute(guild_id, "points_data", data)
+        for guild_id in list(POINTS_DATABASE):
+            if lvbsc.points_journal.needs_compaction(guild_id):
+                try:
+                    await lvbsc.compact_guild_points(guild_id)
+                except Exception as e:
+                    log(f"~1failed to compact points journal for guild {guild_id}: {e}")
+
+def log_pipeline_stats(cog, last: dict) -> dict:
+    """logs the xp pipeline and level up queues if anything happened since the last call (whose stats are last)"""
+    xp = cog.xp_pipeline.stats()
+    level_ups = cog.level_ups.stats()
+    backed_up = xp["pending_awards"] or level_ups["queued"]
+    troubled = xp["dropped"] > last.get("dropped", 0) or level_ups["failed"] > last.get("failed", 0)
+    if backed_up or troubled or level_ups["processed"] != last.get("processed", 0):
+        latency = f"{level_ups['latency_avg']:.1f}s avg, {level_ups['latency_p95']:.1f}s p95" if level_ups["latency_avg"] is not None else "no samples"
+        log(
+            f"{'~3' if backed_up or troubled else '~2'}xp pipeline: {xp['pending_awards']} awards pending, {xp['dropped']} dropped; "
+            f"level ups: {level_ups['queued']} queued, {level_ups['busy']} busy, {level_ups['processed']} done, "
+            f"{level_ups['coalesced']} coalesced, {level_ups['failed']} failed ({latency})"
+        )
+    return {**xp, **level_ups}
+
+def log_cache_stats(last: dict) -> dict:
+    """logs the savedata read cache's hit rate since the last call (whose stats are last), if it was used"""
+    stats = get_cache_stats()
+    hits = stats["hits"] - last.get("hits", 0)
+    misses = stats["misses"] - last.get("misses", 0)
+    if hits or misses:
+        log(
+            f"~2savedata cache: {hits} hits, {misses} misses ({hits / (hits + misses):.0%}), "
+            f"{stats['evictions'] - last.get('evictions', 0)} evictions, {stats['size']}/{stats['max_size']} documents"
+        )
+    return stats
+
+def log_points_memory():
+    report = lvbsc.points_memory_report()
+    log(
+        f"~2points memory: {report['guilds']} guilds loaded ({report['compact_guilds']} compact), {report['users']} users, "
+        f"{report['total_bytes'] / 1e6:.1f}MB, of which {report['rank_index_bytes'] / 1e6:.1f}MB in {report['rank_indexes']} rank indexes "
+        f"and {report['active_bytes'] / 1e6:.1f}MB in active member sets"
+    )
+
+async def evict_idle_regular(cog, interval=GUILD_EVICT_INTERVAL):
+    last_reconcile = time.monotonic()
+    last_memory_report = time.monotonic()
+    last_stats = {}
+    last_cache_stats = {}
+    while True:
+        await asyncio.sleep(interval)
+        if time.monotonic() - last_reconcile >= POSITION_ROLES_RECONCILE_INTERVAL:
+            last_reconcile = time.monotonic()
+            await cog.reconcile_loaded_position_roles()
+        if time.monotonic() - last_memory_report >= MEMORY_REPORT_INTERVAL:
+            last_memory_report = time.monotonic()
+            log_points_memory()
+        lvbsc.drop_cold_rank_indexes()
+        evicted_points = await lvbsc.evict_idle_guild_points()
+        evicted_configs = cog.evict_idle_confighandlers()
+        evicted_members = await aevict_idle_member_tables()
+        expired_cooldowns = cog.cooldowns.expire()
+        if evicted_points or evicted_configs or evicted_members:
+            log(f"~2evicted idle guilds: {evicted_points} points, {evicted_configs} configs, {evicted_members} member tables ({len(POINTS_DATABASE)} guilds still loaded)")
+        if expired_cooldowns:
+            log(f"~2expired {expired_cooldowns} message cooldowns ({len(cog.cooldowns)} still running)")
+        last_stats = log_pipeline_stats(cog, last_stats)
+        last_cache_stats = log_cache_stats(last_cache_stats)
+
+async def global_leaderboard_regular(interval=GLOBAL_LEADERBOARD_INTERVAL):
+    while True:
+        try:
+            await lvglobal.rebuild_global_leaderboards()
+        except Exception as e:
+            log(f"~1failed to rebuild the global leaderboard: {e}")
+        await asyncio.sleep(interval)
 
+async def prune_departed_regular(cog, interval=PRUNE_DEPARTED_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        for guild in list(cog.bot.guilds):
+            try:
+                confighandler = await cog.get_confighandler(guild.id)
+                days = confighandler.get_attribute("prune_departed_days", fallback=0) if confighandler else 0
+                if not days:
+                    continue
+                archived = await lvbsc.archive_departed_points(guild.id, days)
+                if archived:
+                    log(f"~2archived the points of {archived} users who left {guild.name} over {days} days ago")
+            except Exception as e:
+                log(f"~1failed to prune departed members of guild {guild.id}: {e}")
 
 
 class Levels(commands.Cog):
 
 
     def __init__(self, bot: commands.Bot):
-        global POINTS_DATABASE
         self.bot = bot
-        self.generate_handlers()
+        # configs and points are loaded per guild on first use and evicted again once idle
+        self.confighandlers = {}
+        self.message_policies = {} # guild id -> MessagePolicy, compiled from the config on the first message
+        self.reward_tiers = {} # guild id -> RewardTiers, compiled from the config on the first level up
+        self.cooldowns = CooldownTracker() # who spoke recently in which guild, see on_message
+        self.level_ups = LevelUpDispatcher(self.announce_level_up, workers=LEVELUP_WORKERS)
+        self.xp_pipeline = XPPipeline(self.apply_awards, self.level_ups, max_batch=XP_BATCH_SIZE, max_pending=XP_QUEUE_MAX)
+        self.config_usage = IdleTracker(idle_seconds=GUILD_IDLE_SECONDS, max_loaded=GUILD_MAX_LOADED)
+        self.position_role_tasks = {} # guild id -> task reconciling its position roles, see schedule_position_roles
+        self.position_roles_dirty = set() # guilds that got new points while their reconcile was running
         register_config("levels_config")
 
-        self.load_points_data()
         self.autosave_task = None  # track the autosave task
+        self.compact_task = None
+        self.evict_task = None
+        self.prune_task = None
+        self.global_leaderboard_task = None
         self.startup_task = self.bot.loop.create_task(self._background_startup())
 
     async def _background_startup(self):
         await self.bot.wait_until_ready()
+        self.xp_pipeline.start(self.bot.loop)
+        self.level_ups.start(self.bot.loop)
         if not self.autosave_task or self.autosave_task.done():
             self.autosave_task = self.bot.loop.create_task(save_points_regular())
-
-    def generate_handlers(self):
-        self.confighandlers = {}
-        guilds = self.bot.guilds
-        for guild in guilds:
+        if not self.compact_task or self.compact_task.done():
+            self.compact_task = self.bot.loop.create_task(compact_points_regular())
+        if not self.evict_task or self.evict_task.done():
+            self.evict_task = self.bot.loop.create_task(evict_idle_regular(self))
+        if not self.prune_task or self.prune_task.done():
+            self.prune_task = self.bot.loop.create_task(prune_departed_regular(self))
+        if not self.global_leaderboard_task or self.global_leaderboard_task.done():
+            self.global_leaderboard_task = self.bot.loop.create_task(global_leaderboard_regular())
+
+    async def cog_unload(self):
+        for task in (self.autosave_task, self.compact_task, self.evict_task, self.prune_task, self.global_leaderboard_task):
+            if task:
+                task.cancel()
+        for task in list(self.position_role_tasks.values()):
+            task.cancel()
+        self.xp_pipeline.stop()
+        self.level_ups.stop()
+        await self.xp_pipeline.drain()
+        await lvbsc.points_writer.flush(POINTS_DATABASE, force=True)
+
+    async def get_confighandler(self, guild_id: int) -> ConfigHandler:
+        """returns the guild's config handler with its config already loaded, or None if the bot isn't in the guild"""
+        confighandler = self.confighandlers.get(guild_id, None)
+        if confighandler is None:
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                return None
             confighandler = ConfigHandler("levels_config", guild)
-            self.confighandlers[guild.id] = confighandler
+            self.confighandlers[guild_id] = confighandler
+        self.config_usage.touch(guild_id)
+        await confighandler.ensure_loaded()
+        return confighandler
+
+    def evict_idle_confighandlers(self) -> int:
+        # configs are saved on every change, so dropping them needs no flush
+        evicted = self.config_usage.evictable()
+        for guild_id in evicted:
+            self.confighandlers.pop(guild_id, None)
+            self.message_policies.pop(guild_id, None)
+            self.reward_tiers.pop(guild_id, None)
+            self.config_usage.forget(guild_id)
+        return len(evicted)
+
+    async def get_message_policy(self, guild_id: int) -> MessagePolicy:
+        """returns the guild's compiled message policy, recompiling it if its config changed. None if the bot isn't in the guild"""
+        policy = self.message_policies.get(guild_id)
+        if policy is not None and not policy.stale():
+            return policy
+        disabled_cogs = await aget_guild_attribute(guild_id, "disabled_cogs") or []
+        confighandler = await self.get_confighandler(guild_id)
+        if confighandler is None:
+            return None
+        policy = MessagePolicy.compile(confighandler, enabled="Levels" not in disabled_cogs)
+        self.message_policies[guild_id] = policy
+        return policy
+
+    def get_reward_tiers(self, guild_id: int, confighandler: ConfigHandler) -> RewardTiers:
+        """the guild's level role rewards, recompiled if its config changed"""
+        tiers = self.reward_tiers.get(guild_id)
+        if tiers is None or tiers.stale() or tiers.confighandler is not confighandler:
+            tiers = self.reward_tiers[guild_id] = RewardTiers(confighandler)
+        return tiers
 
-    def load_points_data(self):
-        global POINTS_DATABASE
-        guilds = self.bot.guilds
-        for guild in guilds:
-            data = get_guild_attribute(guild.id, "points_data")
-            if data is None:
-                data = {}
-            POINTS_DATABASE[guild.id] = data
+    @commands.Cog.listener()
+    async def on_module_toggled(self, guild: discord.Guild, module: str, enabled: bool):
+        if module == self.qualified_name:
+            self.message_policies.pop(guild.id, None)
+            lvglobal.set_opted_out(guild.id, not enabled)
 
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        log(f"~2removed from guild {guild.name}, dropping its config handler...")
+        self.confighandlers.pop(guild.id, None)
+        self.message_policies.pop(guild.id, None)
+        self.reward_tiers.pop(guild.id, None)
+        self.config_usage.forget(guild.id)
+        self.cooldowns.forget_guild(guild.id)
 
     @commands.Cog.listener()
-    async def on_guild_join(self, guild: discord.Guild):
-        log(f"~2joined guild {guild.name}, regenerating handlers...")
-        self.generate_handlers()
+    async def on_member_join(self, member: discord.Member):
+        if member.bot:
+            return
+        await lvbsc.member_joined(member.guild.id, member.id)
 
     @commands.Cog.listener()
-    async def on_guild_remove(self, guild: discord.Guild):
-        log(f"~2removed from guild {guild.name}, regenerating handlers...")
-        self.generate_handlers()
+    async def on_member_remove(self, member: discord.Member):
+        if member.bot:
+            return
+        await lvbsc.member_left(member.guild.id, member.id)
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
@@ -78,30 +249,21 @@ class Levels(commands.Cog):
         if message.author.bot or message.guild is None:
             return
         
-        disabled_cogs = get_guild_attribute(message.guild.id, "disabled_cogs")
-        if not disabled_cogs:
-            disabled_cogs = []
-        if "Levels" in disabled_cogs:
-            return
-        
-        confighandler = self.confighandlers.get(message.guild.id, None)
-        if confighandler is None:
+        policy = await self.get_message_policy(message.guild.id)
+        if policy is None:
             log(f"~1could not find config handler for guild {message.guild.name}")
             return
-
-        disabled_channels = confighandler.get_attribute("disabled_channels", fallback=[])
-        if message.channel.id in disabled_channels:
-            log(f"~1ignoring message by {message.author.name} in disabled channel {message.channel.name} of guild {message.guild.name}")
+        if not policy.enabled:
             return
 
-        # get the points range from the guild's config
+        if message.channel.id in policy.disabled_channels:
+            return
 
-        points_range = confighandler.get_attribute("points_range", fallback=(1, 5))
-        points_range = tuple(points_range)
+        self.config_usage.touch(message.guild.id)
 
         # calculate the amount of xp to granted without bonuses
 
-        lo, hi = points_range
+        lo, hi = policy.points_range
         amount_to_increase = random.randint(lo, hi)
 
         # calculate long message bonus
@@ -128,33 +290,64 @@ class Levels(commands.Cog):
 
         # check if the user has sent a message within the cooldown
 
-        timestamp = time.time()
-        cooldown = confighandler.get_attribute("message_cooldown", fallback=30)
+        # if the message is bigger than the last one in the cooldown then only the difference is granted,
+        # otherwise it's ignored
 
-        last_entry = recent_speakers.get(message.author.id)
-        last_spoke, last_points = last_entry if last_entry else (None, None)
-        
-        if last_spoke and timestamp - last_spoke < cooldown:
-            if last_points < amount_to_increase: # if the message is bigger than last then grant the difference in points
-                amount_to_increase -= last_points
-                amount_to_increase = max(amount_to_increase, 0) # dont deduct
-                
-                recent_speakers[message.author.id] = (last_spoke, last_points + amount_to_increase)
-                
-            else: # if the message isn't bigger then just ignore it
-                return
-        else:
-            recent_speakers[message.author.id] = (timestamp, amount_to_increase)
+        amount_to_increase = self.cooldowns.claim(message.guild.id, message.author.id, amount_to_increase, policy.message_cooldown)
+        if amount_to_increase <= 0:
+            return
 
-        # increment the points and check if a new role needs to be given
+        # the points are added (and level ups handled) by the xp pipeline, see apply_awards
 
-        new_points, has_levelled_up = lvbsc.increment_user_points(guild=message.guild, user=message.author, amount=amount_to_increase, confighandler=confighandler)
-        new_level, _ = lvbsc.points_to_level(new_points, confighandler)
+        self.xp_pipeline.submit(message.guild, message.author, amount_to_increase)
 
-        if has_levelled_up:
-            await self.level_up(new_level, message.author, message.guild, confighandler)
+    async def apply_awards(self, guild: discord.Guild, awards: dict) -> list[tuple[discord.Member, int]]:
+        """adds a batch of {user id: (member, points)} to a guild, returns (member, new level) for everyone who levelled up"""
+        confighandler = await self.get_confighandler(guild.id)
+        if confighandler is None:
+            return []
+
+        await lvbsc.ensure_guild_points(guild.id)
+        level_ups = []
+        for member, amount in awards.values():
+            new_points, has_levelled_up = lvbsc.increment_user_points(guild=guild, user=member, amount=amount, confighandler=confighandler)
+            if has_levelled_up:
+                new_level, _ = lvbsc.points_to_level(new_points, confighandler)
+                level_ups.append((member, new_level))
+
+        # once per batch instead of once per message, and in its own task so one guild's role edits
+        # (and their rate limits) never hold up the points of the others
+        self.schedule_position_roles(guild, confighandler)
+        return level_ups
+
+    def schedule_position_roles(self, guild: discord.Guild, confighandler: ConfigHandler):
+        """runs update_position_roles for the guild in the background. if it's already running, it runs once
+        more after that instead of twice at the same time"""
+        task = self.position_role_tasks.get(guild.id)
+        if task is not None and not task.done():
+            self.position_roles_dirty.add(guild.id)
+            return
+        self.position_role_tasks[guild.id] = self.bot.loop.create_task(self._run_position_roles(guild, confighandler))
+
+    async def _run_position_roles(self, guild: discord.Guild, confighandler: ConfigHandler):
+        try:
+            while True:
+                self.position_roles_dirty.discard(guild.id)
+                try:
+                    await self.update_position_roles(guild, confighandler)
+                except Exception as e:
+                    log(f"~1failed to update position roles in guild {guild.name}: {e}")
+                if guild.id not in self.position_roles_dirty:
+                    return
+        finally:
+            if self.position_role_tasks.get(guild.id) is asyncio.current_task():
+                del self.position_role_tasks[guild.id]
 
-        await self.update_position_roles(message.guild, confighandler)
+    async def announce_level_up(self, guild: discord.Guild, member: discord.Member, level: int):
+        confighandler = await self.get_confighandler(guild.id)
+        if confighandler is None:
+            return
+        await self.level_up(level, member, guild, confighandler)
 
 
     async def level_up(self, level, user: discord.User, guild: discord.Guild, confighandler: ConfigHandler, retroactive=False):
@@ -162,16 +355,13 @@ class Levels(commands.Cog):
         guild_name = guild.name
 
 
-        potential_rewards = confighandler.get_attribute("levels", fallback=None)
+        member_role_ids = {role.id for role in getattr(user, "roles", ())}
         roles_to_give = []
-        
-        if potential_rewards is not None:
-            for check_level in range(1, level + 1):
-                if check_level in potential_rewards:
-                    role_id = potential_rewards[check_level]
-                    role = guild.get_role(role_id)
-                    if role and role not in user.roles:
-                        roles_to_give.append((check_level, role))
+
+        for check_level, role_id in self.get_reward_tiers(guild.id, confighandler).owed(level, member_role_ids):
+            role = guild.get_role(role_id)
+            if role:
+                roles_to_give.append((check_level, role))
         
         role_up = len(roles_to_give) > 0
 
@@ -202,7 +392,7 @@ class Levels(commands.Cog):
         if role_up:
             for check_level, role in roles_to_give:
                 try:
-                    await user.add_roles(role)
+                    await with_retries(user.add_roles, role)
                     log(f"~2added role {role.name} to {user.name} in {guild_name}")
                 except discord.Forbidden:
                     log(f"~1could not add role {role.name} to {user.name} in {guild_name}, bot does not have permission")
@@ -217,7 +407,7 @@ class Levels(commands.Cog):
 
         # check if the user has toggled off level up pings or if the server setting is off
 
-        shutup = get_guild_member_attribute(guild.id, user.id, "shutup")
+        shutup = await aget_guild_member_attribute(guild.id, user.id, "shutup")
         servershutup = confighandler.get_attribute("servershutup", fallback=False)
 
         shutup = ( shutup or servershutup or retroactive )
@@ -244,18 +434,29 @@ class Levels(commands.Cog):
                 await channel.send(alert_message)
                 log(f"~2sent level up message to {user.name} in {channel.name}")
 
+    async def reconcile_loaded_position_roles(self):
+        """forces a position role check in every guild that is loaded, which catches roles added or removed by hand"""
+        for guild_id in list(POINTS_DATABASE):
+            guild = self.bot.get_guild(guild_id)
+            confighandler = self.confighandlers.get(guild_id)
+            if guild is None or confighandler is None:
+                continue
+            try:
+                await self.update_position_roles(guild, confighandler, force=True)
+            except Exception as e:
+                log(f"~1failed to reconcile position roles in guild {guild.name}: {e}")
+
     async def update_position_roles(self, guild: discord.Guild, confighandler: ConfigHandler, force: bool = False):
+        """reconciles position roles, but only when the holders of the configured positions have changed
+        (or force is set, e.g. after the positions themselves were changed)"""
         position_roles = confighandler.get_attribute("position_roles", fallback={})
         if not position_roles:
             return
 
-        now = time.time()
-        last_update = _position_role_update_cooldowns.get(guild.id, 0)
-        if not force and now - last_update < 60:
+        await lvbsc.ensure_guild_points(guild.id)
+        changed, holders = lvbsc.refresh_top_holders(guild.id, max(int(pos) for pos in position_roles))
+        if not changed and not force:
             return
-        _position_role_update_cooldowns[guild.id] = now
-
-        leaderboard = lvbsc.get_guild_leaderboard(guild.id)
 
         for pos, role_id in position_roles.items():
             pos = int(pos)
@@ -264,9 +465,8 @@ class Levels(commands.Cog):
                 continue
 
             target_member = None
-            if pos <= len(leaderboard):
-                target_user_id = leaderboard[pos - 1][0]
-                target_member = guild.get_member(target_user_id)
+            if pos <= len(holders):
+                target_member = guild.get_member(holders[pos - 1])
 
             if target_member and role not in target_member.roles:
                 try:
@@ -286,16 +486,17 @@ class Levels(commands.Cog):
     @discord.app_commands.default_permissions(manage_roles=True)
     @discord.app_commands.command(name="add_points", description="add points to a user")
     async def add_points(self, interaction: discord.Interaction, user: discord.User, amount: int):
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1add_points: could not find config handler for guild {interaction.guild.name}")
             return
 
+        await lvbsc.ensure_guild_points(interaction.guild.id)
         new_points, has_levelled_up = lvbsc.increment_user_points(guild=interaction.guild, user=user, amount=amount, confighandler=confighandler)
         new_level, _ = lvbsc.points_to_level(new_points, confighandler)
 
         if has_levelled_up:
-            await self.level_up(new_level, user, interaction.guild, confighandler)
+            self.level_ups.submit(interaction.guild, user, new_level)
 
         await self.update_position_roles(interaction.guild, confighandler, force=True)
         await interaction.response.send_message(f"added {amount} points to {user.mention}", allowed_mentions=discord.AllowedMentions.none())
@@ -303,29 +504,17 @@ class Levels(commands.Cog):
     @discord.app_commands.default_permissions(manage_roles=True)
     @discord.app_commands.command(name="set_points", description="set points for a user")
     async def set_points(self, interaction: discord.Interaction, user: discord.User, amount: int):
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1set_points: could not find config handler for guild {interaction.guild.name}")
             return
-        guild_id = interaction.guild.id
-        user_id = user.id
-
-        # make sure guild entry actually exists
-        if guild_id not in POINTS_DATABASE:
-            POINTS_DATABASE[guild_id] = {}
-
-        user_points_before = POINTS_DATABASE[guild_id].get(user_id, 0)
-        user_level_before, _ = lvbsc.points_to_level(user_points_before, confighandler)
-
-        # set the new absolute points
-        POINTS_DATABASE[guild_id][user_id] = int(amount)
-        new_points = POINTS_DATABASE[guild_id][user_id]
 
-        user_level_after, _ = lvbsc.points_to_level(new_points, confighandler)
-        has_levelled_up = user_level_after > user_level_before
+        await lvbsc.ensure_guild_points(interaction.guild.id)
+        new_points, has_levelled_up = lvbsc.set_user_points(guild=interaction.guild, user=user, amount=amount, confighandler=confighandler)
+        new_level, _ = lvbsc.points_to_level(new_points, confighandler)
 
         if has_levelled_up:
-            await self.level_up(user_level_after, user, interaction.guild, confighandler)
+            self.level_ups.submit(interaction.guild, user, new_level)
 
         await self.update_position_roles(interaction.guild, confighandler, force=True)
         await interaction.response.send_message(f"set {user.mention}'s points to {amount}", allowed_mentions=discord.AllowedMentions.none())
@@ -339,10 +528,10 @@ class Levels(commands.Cog):
             return
         user_id = interaction.user.id
 
-        current_toggle = get_guild_member_attribute(guild_id, user_id, "shutup")
+        current_toggle = await aget_guild_member_attribute(guild_id, user_id, "shutup")
         current_toggle = False if current_toggle == None else current_toggle
 
-        set_guild_member_attribute(guild_id, user_id, key="shutup", value=(not current_toggle))
+        await aset_guild_member_attribute(guild_id, user_id, key="shutup", value=(not current_toggle))
 
         if not current_toggle: # was false, now true
             await interaction.response.send_message(f"i won't send you levelup messages anymore")
@@ -352,7 +541,7 @@ class Levels(commands.Cog):
     @discord.app_commands.default_permissions(manage_roles=True)
     @discord.app_commands.command(name="server_shut_up", description="toggle levelup/roleup pings/dms for the entire server")
     async def server_shut_up(self, interaction: discord.Interaction):
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1server_shut_up: could not find config handler for guild {interaction.guild.name}")
             await interaction.response.send_message("there was an error with this guild's confighandler", ephemeral=True)
@@ -360,7 +549,7 @@ class Levels(commands.Cog):
 
         current_toggle = confighandler.get_attribute("servershutup", fallback=False)
 
-        confighandler.set_attribute("servershutup", not current_toggle)
+        await confighandler.aset_attribute("servershutup", not current_toggle)
 
         if not current_toggle: # was false, now true
             await interaction.response.send_message(f"i won't send levelup messages in this server anymore")
@@ -371,7 +560,7 @@ class Levels(commands.Cog):
     @discord.app_commands.default_permissions(manage_channels=True)
     @discord.app_commands.command(name="set_levelup_channel", description="set the channel that levelup messages are sent in")
     async def set_levelup_channel(self, interaction: discord.Interaction, channel: discord.TextChannel):
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1set_levelup_channel: could not find config handler for guild {interaction.guild.name}")
             return
@@ -380,10 +569,10 @@ class Levels(commands.Cog):
         
         current_channel = confighandler.get_attribute("alert_channel")
         if channel_id == current_channel:
-            confighandler.set_attribute("alert_channel", None)
+            await confighandler.aset_attribute("alert_channel", None)
             await interaction.response.send_message(f"set the current alert channel to DM")
         else:
-            confighandler.set_attribute("alert_channel", channel_id)
+            await confighandler.aset_attribute("alert_channel", channel_id)
             verified = confighandler.get_attribute("alert_channel")
 
             if channel_id == verified:
@@ -401,7 +590,7 @@ class Levels(commands.Cog):
             await interaction.response.send_message("this command can only be used in a server.", ephemeral=True)
             return
 
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1set_leaderboard_theme: could not find config handler for guild {interaction.guild.name}")
             return
@@ -419,13 +608,13 @@ class Levels(commands.Cog):
             return
 
         if is_reset:
-            confighandler.set_attribute("colour", None)
+            await confighandler.aset_attribute("colour", None)
             log(f"~2server {interaction.guild.name} theme cleared")
             await interaction.response.send_message("the server theme will now be picked randomly")
             return
         else:
             rgb = lvbsc.hex_to_rgb(colour)
-            confighandler.set_attribute("colour", rgb)
+            await confighandler.aset_attribute("colour", rgb)
             log(f"~2server {interaction.guild.name} theme set to {colour} f{rgb}")
             await interaction.response.send_message(f"the server theme base colour has been set to {colour}")
             return
@@ -450,13 +639,13 @@ class Levels(commands.Cog):
             return
 
         if is_reset:
-            set_guild_member_attribute(guild_id, user_id, key="colour", value=None)
+            await aset_guild_member_attribute(guild_id, user_id, key="colour", value=None)
             log(f"~2user {interaction.user.name} theme cleared")
             await interaction.response.send_message("your personal theme has been reset to the server/default theme.", ephemeral=True)
             return
         else:
             rgb = lvbsc.hex_to_rgb(colour)
-            set_guild_member_attribute(guild_id, user_id, key="colour", value=rgb)
+            await aset_guild_member_attribute(guild_id, user_id, key="colour", value=rgb)
             log(f"~2user {interaction.user.name} theme set to {colour} f{rgb}")
             await interaction.response.send_message(f"your personal theme color has been set to {colour}", ephemeral=True)
             return
@@ -464,7 +653,7 @@ class Levels(commands.Cog):
     @discord.app_commands.default_permissions(manage_roles=True)
     @discord.app_commands.command(name="set_xp_range", description="set a range for xp granted on message")
     async def set_xp_range(self, interaction: discord.Interaction, min:int, max:int):
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1set_xp_range: could not find config handler for guild {interaction.guild.name}")
             return
@@ -473,18 +662,67 @@ class Levels(commands.Cog):
             await interaction.response.send_message("invalid range, make sure 0 <= min <= max", ephemeral=True)
             return
         
-        confighandler.set_attribute("points_range", (min, max))
+        await confighandler.aset_attribute("points_range", (min, max))
         average = (min + max) // 2
         await interaction.response.send_message(f"set xp range to {min}-{max} (average {average})", ephemeral=True)
         log(f"~2set xp range to {min}-{max} in guild {interaction.guild.name}")
 
+    @discord.app_commands.default_permissions(manage_guild=True)
+    @discord.app_commands.command(name="set_level_curve", description="set how many points each level needs")
+    @discord.app_commands.describe(
+        curve="quadratic: (level * k)^2, linear: base per level, exponential: base growing by growth_rate each level, table: your own thresholds",
+        table="total points for level 1, 2, 3... separated by commas, later levels keep the last gap"
+    )
+    @discord.app_commands.choices(curve=[
+        discord.app_commands.Choice(name=name, value=name) for name in ("quadratic", "linear", "exponential", "table")
+    ])
+    async def set_level_curve(self, interaction: discord.Interaction, curve: str, k: float = None, base: float = None, growth_rate: float = None, table: str = None):
+        confighandler = await self.get_confighandler(interaction.guild.id)
+        if confighandler is None:
+            log(f"~1set_level_curve: could not find config handler for guild {interaction.guild.name}")
+            return
+
+        settings = {"level_curve": curve}
+        if curve == "quadratic":
+            settings["k"] = k if k is not None else confighandler.get_attribute("k", fallback=lvbsc.K_FALLBACK)
+        elif curve == "linear":
+            settings["base"] = base
+        elif curve == "exponential":
+            settings["base"] = base
+            settings["growth_rate"] = growth_rate
+        elif curve == "table":
+            try:
+                settings["level_table"] = [int(points) for points in (table or "").split(",") if points.strip()] or None
+            except ValueError:
+                await interaction.response.send_message("the table has to be whole numbers separated by commas", ephemeral=True)
+                return
+
+        missing = [name for name in level_curve.CURVE_PARAMETERS[curve] if settings.get(name) is None]
+        if missing:
+            needed = " and ".join("table" if name == "level_table" else name for name in missing)
+            await interaction.response.send_message(f"the {curve} curve needs {needed} to be set", ephemeral=True)
+            return
+
+        try:
+            level_curve.build_curve(level_curve.curve_key(settings, lvbsc.K_FALLBACK))
+        except (TypeError, ValueError) as e:
+            await interaction.response.send_message(f"invalid {curve} curve: {e}", ephemeral=True)
+            return
+
+        # all at once, so no message is levelled with the new curve and the old settings
+        await confighandler.aset_attributes(settings)
+
+        preview = ", ".join(f"{level}: {lvbsc.level_to_points(level, confighandler)}" for level in (1, 2, 5, 10, 25))
+        await interaction.response.send_message(f"set the level curve to {curve} (points needed per level: {preview})", ephemeral=True)
+        log(f"~2set level curve to {settings} in guild {interaction.guild.name}")
+
         
 
 
     @discord.app_commands.default_permissions(manage_roles=True)
     @discord.app_commands.command(name="set_level_role", description="set a role to be given on level up")
     async def set_level_role(self, interaction: discord.Interaction, level: int, role: discord.Role):
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1set_level_role: could not find config handler for guild {interaction.guild.name}")
             return
@@ -502,19 +740,15 @@ class Levels(commands.Cog):
             await interaction.response.send_message(f"level {level} already has a role assigned", ephemeral=True)
             return
         roles[level] = role.id
-        confighandler.set_attribute("levels", roles)
+        await confighandler.aset_attribute("levels", roles)
         await interaction.response.send_message(f"set role {role.name} for level {level}", ephemeral=True)
         log(f"~2set level role {role.name} for level {level} in guild {interaction.guild.name}")
 
         # give all members who should have the role already
 
-        leaderboard = lvbsc.get_guild_leaderboard(interaction.guild.id)
+        await lvbsc.ensure_guild_points(interaction.guild.id)
         points_needed = lvbsc.level_to_points(level, confighandler)
-
-        applicable_members = []
-        for member_id, member_points in leaderboard:
-            if member_points >= points_needed:
-                applicable_members.append(member_id)
+        applicable_members = [member_id for member_id, _ in lvbsc.get_users_with_at_least(interaction.guild.id, points_needed)]
 
         for member_id in applicable_members:
             member = interaction.guild.get_member(member_id)
@@ -529,7 +763,7 @@ class Levels(commands.Cog):
     @discord.app_commands.default_permissions(manage_roles=True)
     @discord.app_commands.command(name="unset_level_role", description="clear a level of rewards")
     async def unset_level_role(self, interaction: discord.Interaction, level: int):
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1unset_level_role: could not find config handler for guild {interaction.guild.name}")
             return
@@ -543,7 +777,7 @@ class Levels(commands.Cog):
             del roles[level]
             await interaction.response.send_message(f"level {level} has been cleared of reward", ephemeral=True)
             log(f"~2cleared level role for level {level} in guild {interaction.guild.name}")
-            confighandler.set_attribute("levels", roles)
+            await confighandler.aset_attribute("levels", roles)
             return
         else:
             await interaction.response.send_message(f"that level doesn't have a role reward, so it couldn't be deleted.", ephemeral=True)
@@ -552,7 +786,7 @@ class Levels(commands.Cog):
     @discord.app_commands.default_permissions(manage_roles=True)
     @discord.app_commands.command(name="set_position_role", description="set a role to be given to a leaderboard position")
     async def set_position_role(self, interaction: discord.Interaction, position: int, role: discord.Role):
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1set_position_role: could not find config handler for guild {interaction.guild.name}")
             return
@@ -567,16 +801,16 @@ class Levels(commands.Cog):
 
         position_roles = confighandler.get_attribute("position_roles", fallback={})
         position_roles[position] = role.id
-        confighandler.set_attribute("position_roles", position_roles)
+        await confighandler.aset_attribute("position_roles", position_roles)
         await interaction.response.send_message(f"set role {role.mention} for leaderboard position {position}", ephemeral=True, allowed_mentions=discord.AllowedMentions.none())
         log(f"~2set position role {role.name} for position {position} in guild {interaction.guild.name}")
 
-        await self.update_position_roles(interaction.guild, confighandler)
+        await self.update_position_roles(interaction.guild, confighandler, force=True)
 
     @discord.app_commands.default_permissions(manage_roles=True)
     @discord.app_commands.command(name="unset_position_role", description="clear a leaderboard position of its role reward")
     async def unset_position_role(self, interaction: discord.Interaction, position: int):
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1unset_position_role: could not find config handler for guild {interaction.guild.name}")
             return
@@ -588,7 +822,7 @@ class Levels(commands.Cog):
         position_roles = confighandler.get_attribute("position_roles", fallback={})
         if position in position_roles:
             role_id = position_roles.pop(position)
-            confighandler.set_attribute("position_roles", position_roles)
+            await confighandler.aset_attribute("position_roles", position_roles)
             role = interaction.guild.get_role(role_id)
             if role:
                 for member in role.members:
@@ -604,7 +838,7 @@ class Levels(commands.Cog):
     @discord.app_commands.command(name="position_roles", description="get the list of leaderboard position role rewards")
     async def position_roles_list(self, interaction: discord.Interaction):
         allowed_mentions = discord.AllowedMentions.none()
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1position_roles: could not find config handler for guild {interaction.guild.name}")
             await interaction.response.send_message("there was an error with this guild's confighandler", ephemeral=True, allowed_mentions=allowed_mentions)
@@ -627,10 +861,44 @@ class Levels(commands.Cog):
         msg = "leaderboard position role rewards for this server:\n" + "\n".join(lines)
         await interaction.response.send_message(msg, allowed_mentions=allowed_mentions)
 
+    @discord.app_commands.command(name="level_stats", description="get the level distribution for this server")
+    async def level_stats(self, interaction: discord.Interaction):
+        confighandler = await self.get_confighandler(interaction.guild.id)
+        if confighandler is None:
+            log(f"~1level_stats: could not find config handler for guild {interaction.guild.name}")
+            await interaction.response.send_message("there was an error with this guild's confighandler", ephemeral=True)
+            return
+
+        guild_points = await lvbsc.ensure_guild_points(interaction.guild.id)
+        # worked out from a copy-on-write snapshot in a worker thread, so messages keep being counted meanwhile
+        stats = await asyncio.get_running_loop().run_in_executor(
+            None, lvengine.guild_level_stats, guild_points.snapshot(), lvbsc.get_curve(confighandler)
+        )
+        if not stats["count"]:
+            await interaction.response.send_message("nobody has any points in this server yet!", ephemeral=True)
+            return
+
+        histogram = lvengine.bucket_histogram(stats["histogram"])
+        most_users = max(users for _, _, users in histogram)
+        lines = []
+        for lowest, highest, users in histogram:
+            label = f"{lowest}" if lowest == highest else f"{lowest}-{highest}"
+            bar = "█" * round(users / most_users * 20)
+            lines.append(f"{label:>9} | {bar} {users}")
+
+        percentiles = ", ".join(f"p{percentile}: {level}" for percentile, level in stats["percentiles"].items())
+        msg = (
+            f"level stats for {interaction.guild.name} ({stats['count']} users)\n"
+            f"median level: {stats['median']:g}\n"
+            f"{percentiles}\n"
+            "```\n" + "\n".join(lines) + "\n```"
+        )
+        await interaction.response.send_message(msg)
+
     @discord.app_commands.command(name="roles", description="get the list of role rewards for this server")
     async def roles(self, interaction: discord.Interaction):
         allowed_mentions = discord.AllowedMentions.none()
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1roles: could not find config handler for guild {interaction.guild.name}")
             await interaction.response.send_message("there was an error with this guild's confighandler", ephemeral=True, allowed_mentions=allowed_mentions)
@@ -655,7 +923,7 @@ class Levels(commands.Cog):
     @discord.app_commands.default_permissions(manage_channels=True)
     @discord.app_commands.command(name="toggle_xp", description="toggle whether users can gain xp in a specific channel")
     async def toggle_xp_channel(self, interaction: discord.Interaction, channel: discord.TextChannel):
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1toggle_xp: could not find config handler for guild {interaction.guild.name}")
             await interaction.response.send_message("there was an error with this guild's confighandler", ephemeral=True)
@@ -665,12 +933,12 @@ class Levels(commands.Cog):
         
         if channel.id in disabled_channels:
             disabled_channels.remove(channel.id)
-            confighandler.set_attribute("disabled_channels", disabled_channels)
+            await confighandler.aset_attribute("disabled_channels", disabled_channels)
             await interaction.response.send_message(f"xp gain has been enabled in {channel.mention}")
             log(f"~2enabled xp gain in {channel.name} for guild {interaction.guild.name}")
         else:
             disabled_channels.append(channel.id)
-            confighandler.set_attribute("disabled_channels", disabled_channels)
+            await confighandler.aset_attribute("disabled_channels", disabled_channels)
             await interaction.response.send_message(f"xp gain has been disabled in {channel.mention}")
             log(f"~2disabled xp gain in {channel.name} for guild {interaction.guild.name}")
         
@@ -679,7 +947,7 @@ class Levels(commands.Cog):
 
     @discord.app_commands.command(name="rank", description="get your rank in the leaderboard.")
     async def rank(self, interaction: discord.Interaction, target: discord.Member=None):
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1rank: could not find config handler for guild {interaction.guild.name}")
             await interaction.response.send_message("there was an error with this guild's confighandler", ephemeral=True)
@@ -693,21 +961,11 @@ class Levels(commands.Cog):
 
         theme = confighandler.get_attribute("colour", fallback=(40, 40, 40))
 
-        leaderboard = lvbsc.format_leaderboard(
-            guild_id=interaction.guild.id,
-            confighandler=confighandler
-        )
-
-        user_id = target.id
-        user_entry = None
-        for entry in leaderboard:
-            if entry[2] == user_id:
-                user_entry = entry
-                break
+        await lvbsc.ensure_guild_points(interaction.guild.id)
+        await aget_member_table(interaction.guild.id) # themes are looked up per entry
+        rank_context = LeaderboardView(interaction.guild, confighandler).rank_context(target.id)
 
-        
-
-        if not user_entry:
+        if rank_context is None:
             await interaction.response.send_message(f"{'you' if self else 'they'} are not on the leaderboard yet!", ephemeral=True)
             return
 
@@ -716,8 +974,7 @@ class Levels(commands.Cog):
         image_path = lvrc.generate_rank_card_image(
             guild_id=interaction.guild.id,
             guild_name=interaction.guild.name,
-            leaderboard=leaderboard,
-            user_requested=user_id,
+            rank_context=rank_context,
             theme=theme,
             avatar=avatar_bytes
         )
@@ -734,8 +991,9 @@ class Levels(commands.Cog):
     # TODO: make themes a proper config thing
 
     @discord.app_commands.command(name="leaderboard", description="get the leaderboard for the guild.")
-    async def leaderboard(self, interaction: discord.Interaction, page:int=1):
-        confighandler = self.confighandlers.get(interaction.guild.id, None)
+    @discord.app_commands.describe(around_me="show the page of the leaderboard centred on you instead of a page number")
+    async def leaderboard(self, interaction: discord.Interaction, page:int=1, around_me:bool=False):
+        confighandler = await self.get_confighandler(interaction.guild.id)
         if confighandler is None:
             log(f"~1leaderboard: could not find config handler for guild {interaction.guild.name}")
             return
@@ -746,10 +1004,13 @@ class Levels(commands.Cog):
         else:
             guild_icon = None
 
-        leaderboard = lvbsc.format_leaderboard(
-            guild_id=interaction.guild.id,
-            confighandler=confighandler
-        )
+        await lvbsc.ensure_guild_points(interaction.guild.id)
+        await aget_member_table(interaction.guild.id) # themes are looked up per row
+        leaderboard = LeaderboardView(interaction.guild, confighandler)
+
+        if around_me and lvbsc.get_user_position(interaction.guild.id, interaction.user.id) == -1:
+            await interaction.response.send_message("you are not on the leaderboard yet!", ephemeral=True)
+            return
 
         image_path = lvlb.generate_leaderboard_image(
             guild_id=interaction.guild.id,
@@ -758,7 +1019,8 @@ class Levels(commands.Cog):
             max_rows=6,
             page_requested=page,
             theme=theme,
-            icon=guild_icon
+            icon=guild_icon,
+            around_user_id=interaction.user.id if around_me else None
         )
 
         image_path = str(image_path)
@@ -767,6 +1029,40 @@ class Levels(commands.Cog):
 
         await interaction.response.send_message(file=file)
 
+    @discord.app_commands.command(name="global_leaderboard", description="get the leaderboard across every server the bot is in.")
+    @discord.app_commands.describe(mode="sum: points from every server added up, max: points in the best server")
+    @discord.app_commands.choices(mode=[
+        discord.app_commands.Choice(name=name, value=name) for name in lvglobal.GLOBAL_MODES
+    ])
+    async def global_leaderboard(self, interaction: discord.Interaction, mode: str = "sum", page: int = 1):
+        leaderboard = lvglobal.get_global_leaderboard(mode)
+        if leaderboard is None:
+            await interaction.response.send_message("the global leaderboard is still being put together, try again in a minute!", ephemeral=True)
+            return
+        if not len(leaderboard):
+            await interaction.response.send_message("nobody has any points yet!", ephemeral=True)
+            return
+
+        PER_PAGE = 10
+        total_pages = leaderboard.total_pages(PER_PAGE)
+        page = min(max(page, 1), total_pages)
+
+        lines = []
+        for position, user_id, points in leaderboard.page(page, PER_PAGE):
+            user = self.bot.get_user(user_id)
+            name = user.name if user else f"unknown user {user_id}"
+            lines.append(f"#{position:<5} {name} - {points} points")
+
+        position = leaderboard.position(interaction.user.id)
+        footer = f"you are #{position} with {leaderboard.get(interaction.user.id)} points" if position > 0 else "you are not on the global leaderboard yet"
+        updated = int(leaderboard.built_at)
+        msg = (
+            f"global leaderboard ({mode} of points across {leaderboard.guilds} servers), page {page}/{total_pages}, updated <t:{updated}:R>\n"
+            "```\n" + "\n".join(lines) + "\n```\n"
+            + footer
+        )
+        await interaction.response.send_message(msg)
+
             
 
 
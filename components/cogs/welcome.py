@@ -1,10 +1,13 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
+import asyncio
 
 from components.function.logging import log
 from components.function.msgformat import format_msg
 from components.classes.confighandler import ConfigHandler, register_config
+from components.classes.idle_tracker import IdleTracker
+from components.shared_instances import GUILD_IDLE_SECONDS, GUILD_MAX_LOADED, GUILD_EVICT_INTERVAL
 
 
 class Welcome(commands.Cog): 
@@ -12,24 +15,32 @@ class Welcome(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         register_config("welcome_config")
-        self.generate_handlers()
-
-    def generate_handlers(self):
+        # configs are loaded on first use and dropped again once the guild goes idle
         self.confighandlers = {}
-        guilds = self.bot.guilds
-        for guild in guilds:
-            confighandler = ConfigHandler("welcome_config", guild)
-            confighandler.load_config()
-            self.confighandlers[guild.id] = confighandler
+        self.config_usage = IdleTracker(idle_seconds=GUILD_IDLE_SECONDS, max_loaded=GUILD_MAX_LOADED)
+        self.evict_task = self.bot.loop.create_task(self.evict_idle_regular())
+
+    async def cog_unload(self):
+        self.evict_task.cancel()
+
+    async def evict_idle_regular(self, interval=GUILD_EVICT_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            for guild_id in self.config_usage.evictable():
+                self.confighandlers.pop(guild_id, None)
+                self.config_usage.forget(guild_id)
 
-    def get_config(self, guild_id: int) -> ConfigHandler:
+    async def get_config(self, guild_id: int) -> ConfigHandler:
         if guild_id not in self.confighandlers:
             guild = self.bot.get_guild(guild_id)
             if guild:
                 confighandler = ConfigHandler("welcome_config", guild)
-                confighandler.load_config()
                 self.confighandlers[guild_id] = confighandler
-        return self.confighandlers.get(guild_id)
+        confighandler = self.confighandlers.get(guild_id)
+        if confighandler is not None:
+            self.config_usage.touch(guild_id)
+            await confighandler.ensure_loaded()
+        return confighandler
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -38,7 +49,7 @@ class Welcome(commands.Cog):
     @commands.Cog.listener()
     async def on_member_join(self, member):
         guild = member.guild
-        config = self.get_config(guild.id)
+        config = await self.get_config(guild.id)
 
         notifchannel = config.get_attribute("notifchannel", None)
         if notifchannel:
@@ -67,7 +78,7 @@ class Welcome(commands.Cog):
     @commands.Cog.listener()
     async def on_member_remove(self, member):
         guild = member.guild
-        config = self.get_config(guild.id)
+        config = await self.get_config(guild.id)
 
         notifchannel = config.get_attribute("notifchannel", None)
         if notifchannel:
@@ -96,7 +107,7 @@ class Welcome(commands.Cog):
     @app_commands.command(name="set_welcome_channel", description="set the channel where join/leave messages are sent")
     @app_commands.default_permissions(manage_channels=True)
     async def set_welcome_channel(self, interaction: discord.Interaction, channel: discord.TextChannel):
-        config = self.get_config(interaction.guild.id)
+        config = await self.get_config(interaction.guild.id)
         permissions = channel.permissions_for(interaction.guild.me)
         can_send = permissions.send_messages
 
@@ -104,7 +115,7 @@ class Welcome(commands.Cog):
             await interaction.response.send_message("i can't send messages there!", ephemeral=True)
             return
 
-        config.set_attribute("notifchannel", channel.id)
+        await config.aset_attribute("notifchannel", channel.id)
 
         await interaction.response.send_message(f"welcome channel set to {channel.mention}!")
         log(f"~2set welcome channel to {channel.name} in {interaction.guild.name}")
@@ -112,21 +123,21 @@ class Welcome(commands.Cog):
     @app_commands.command(name="disable_welcome_channel", description="disable welcome messages")
     @app_commands.default_permissions(manage_channels=True)
     async def disable_welcome_channel(self, interaction: discord.Interaction):
-        config = self.get_config(interaction.guild.id)
+        config = await self.get_config(interaction.guild.id)
         old_channel_id = config.get_attribute("notifchannel", None)
         
         if not old_channel_id:
             await interaction.response.send_message("welcome messages are already disabled!", ephemeral=True)
             return
         
-        config.set_attribute("notifchannel", None)
+        await config.aset_attribute("notifchannel", None)
         await interaction.response.send_message("welcome messages disabled!")
         log(f"~2disabled welcome channel in {interaction.guild.name}")
 
     @app_commands.command(name="set_join_message", description="set the message sent to join users")
     @app_commands.default_permissions(manage_channels=True)
     async def set_join_message(self, interaction: discord.Interaction, message: str):
-        config = self.get_config(interaction.guild.id)
+        config = await self.get_config(interaction.guild.id)
         guild = interaction.guild
         invoker = interaction.user
 
@@ -135,7 +146,7 @@ class Welcome(commands.Cog):
         try:
             message_formatted = format_msg(message, guild, invoker)
             old_message = config.get_attribute("joinmsg")
-            config.set_attribute("joinmsg", message)
+            await config.aset_attribute("joinmsg", message)
 
             bot_response = (
                 f"your new join message has been set to:\n\n"
@@ -154,7 +165,7 @@ class Welcome(commands.Cog):
     @app_commands.command(name="set_leave_message", description="set the message sent to leaving users")
     @app_commands.default_permissions(manage_channels=True)
     async def set_leave_message(self, interaction: discord.Interaction, message: str):
-        config = self.get_config(interaction.guild.id)
+        config = await self.get_config(interaction.guild.id)
         guild = interaction.guild
         invoker = interaction.user
 
@@ -163,7 +174,7 @@ class Welcome(commands.Cog):
         try:
             message_formatted = format_msg(message, guild, invoker)
             old_message = config.get_attribute("leavemsg")
-            config.set_attribute("leavemsg", message)
+            await config.aset_attribute("leavemsg", message)
 
             bot_response = (
                 f"your new leave message has been set to:\n\n"
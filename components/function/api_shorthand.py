@@ -1,7 +1,7 @@
 import discord
 
 from components.shared_instances import bot, shcogs
-from components.function.savedata import get_guild_attribute
+from components.function.savedata import aget_guild_attribute
 
 async def is_user_banned(user_id: int, guild_id: int) -> bool:
     """checks if a user is banned in a guild"""
@@ -23,7 +23,7 @@ async def sync_cogs_for_guild(bot, tree, guild):
     guild_obj = discord.Object(id=guild.id)
     tree.clear_commands(guild=guild_obj)
 
-    disabled = get_guild_attribute(guild.id, "disabled_cogs")
+    disabled = await aget_guild_attribute(guild.id, "disabled_cogs")
     disabled = [] if disabled is None else disabled
 
     for cog_name, cog in bot.cogs.items():
@@ -0,0 +1,210 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import yaml
+import zlib
+from datetime import datetime
+
+from components.function.logging import log
+from components.shared_instances import BACKUP_KEEP
+
+# incremental savedata backups
+#
+# every backup is a manifest (backups/manifests/<timestamp>.yaml) listing each file under savedata with the
+# sha256 of its contents. the contents themselves live once in a content-addressed store
+# (backups/objects/<hash[:2]>/<hash>, zlib compressed), so a file that hasn't changed since the last backup
+# costs one manifest line instead of another copy. files whose size and mtime match the last manifest
+# aren't even re-read.
+#
+# only the newest BACKUP_KEEP manifests are kept, objects no manifest refers to any more are deleted.
+# restoring rebuilds a snapshot into a separate directory: python -m components.function.backup restore <name>
+
+SAVEDATA_DIR = "savedata"
+BACKUPS_DIR = os.path.join(os.path.dirname(os.getcwd()), "ldu_backups")
+EXCLUDED_DIRS = {os.path.join(SAVEDATA_DIR, "temp")}
+EXCLUDED_SUFFIXES = (".tmp", "-wal", "-shm", "-journal") # half-written files and sqlite's side files
+
+def objects_dir(backups_dir: str = BACKUPS_DIR) -> str:
+    return os.path.join(backups_dir, "objects")
+
+def manifests_dir(backups_dir: str = BACKUPS_DIR) -> str:
+    return os.path.join(backups_dir, "manifests")
+
+def object_path(digest: str, backups_dir: str = BACKUPS_DIR) -> str:
+    return os.path.join(objects_dir(backups_dir), digest[:2], digest)
+
+# MANIFESTS ============================================================================================================
+
+def list_backups(backups_dir: str = BACKUPS_DIR) -> list[str]:
+    """returns the names of every backup, oldest first"""
+    directory = manifests_dir(backups_dir)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(file[:-len(".yaml")] for file in os.listdir(directory) if file.endswith(".yaml"))
+
+def read_manifest(name: str, backups_dir: str = BACKUPS_DIR) -> dict:
+    with open(os.path.join(manifests_dir(backups_dir), f"{name}.yaml"), "r", encoding="utf-8") as f:
+        try:
+            return yaml.safe_load(f) or {}
+        except yaml.YAMLError as e:
+            raise ValueError(f"backup manifest {name} is corrupt: {e}")
+
+def write_manifest(name: str, manifest: dict, backups_dir: str = BACKUPS_DIR):
+    directory = manifests_dir(backups_dir)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.yaml")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        yaml.dump(manifest, f, Dumper=yaml.SafeDumper)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path) # the manifest goes last, so a backup only exists once all its objects do
+
+# OBJECTS ==============================================================================================================
+
+def store_object(data: bytes, backups_dir: str = BACKUPS_DIR) -> tuple[str, bool]:
+    """stores data in the object store, returns (sha256, whether it was new)"""
+    digest = hashlib.sha256(data).hexdigest()
+    path = object_path(digest, backups_dir)
+    if os.path.exists(path):
+        return digest, False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(zlib.compress(data))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+    return digest, True
+
+def read_object(digest: str, backups_dir: str = BACKUPS_DIR) -> bytes:
+    with open(object_path(digest, backups_dir), "rb") as f:
+        data = zlib.decompress(f.read())
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"backup object {digest} is corrupt")
+    return data
+
+def read_savedata_file(path: str) -> bytes:
+    """reads a file for backing up. sqlite databases are copied with the backup api so a write in progress
+    can't leave us with a torn copy"""
+    if not path.endswith(".db"):
+        with open(path, "rb") as f:
+            return f.read()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        copy_path = os.path.join(temp_dir, "copy.db")
+        source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        destination = sqlite3.connect(copy_path)
+        try:
+            source.backup(destination)
+        finally:
+            destination.close()
+            source.close()
+        with open(copy_path, "rb") as f:
+            return f.read()
+
+# BACKING UP ===========================================================================================================
+
+def walk_savedata(savedata_dir: str = SAVEDATA_DIR):
+    """yields (path, path relative to savedata_dir) for every file worth backing up"""
+    for root, dirs, files in os.walk(savedata_dir):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) not in EXCLUDED_DIRS]
+        for file in files:
+            if file.endswith(EXCLUDED_SUFFIXES):
+                continue
+            path = os.path.join(root, file)
+            yield path, os.path.relpath(path, savedata_dir).replace(os.sep, "/")
+
+def create_backup(savedata_dir: str = SAVEDATA_DIR, backups_dir: str = BACKUPS_DIR) -> tuple[str, int, int]:
+    """backs up savedata_dir. returns (backup name, files in the backup, files that had to be stored).
+    blocking, run it in a worker thread"""
+    previous = {}
+    backups = list_backups(backups_dir)
+    if backups:
+        previous = read_manifest(backups[-1], backups_dir).get("files", {})
+
+    files = {}
+    stored = 0
+    for path, relative_path in walk_savedata(savedata_dir):
+        try:
+            stat = os.stat(path)
+            entry = previous.get(relative_path)
+            unchanged = (
+                entry is not None
+                and entry.get("size") == stat.st_size
+                and entry.get("mtime_ns") == stat.st_mtime_ns
+                and os.path.exists(object_path(entry["hash"], backups_dir))
+            )
+            if unchanged:
+                files[relative_path] = entry
+                continue
+
+            digest, new = store_object(read_savedata_file(path), backups_dir)
+        except (OSError, sqlite3.Error) as e:
+            log(f"~1could not back up {path}: {e}")
+            continue
+        stored += new
+        files[relative_path] = {"hash": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    name = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if backups and name <= backups[-1]:
+        name = f"{backups[-1]}_1" # two backups in the same second, keep the names sorted
+    write_manifest(name, {"created": datetime.now().isoformat(), "files": files}, backups_dir)
+    return name, len(files), stored
+
+def prune_backups(keep: int = BACKUP_KEEP, backups_dir: str = BACKUPS_DIR) -> tuple[int, int]:
+    """deletes all but the newest keep backups and any objects only they used.
+    returns (backups deleted, objects deleted)"""
+    backups = list_backups(backups_dir)
+    expired = backups[:-keep] if keep > 0 else []
+    for name in expired:
+        os.remove(os.path.join(manifests_dir(backups_dir), f"{name}.yaml"))
+
+    referenced = set()
+    for name in list_backups(backups_dir):
+        referenced.update(entry["hash"] for entry in read_manifest(name, backups_dir).get("files", {}).values())
+
+    deleted_objects = 0
+    for root, dirs, files in os.walk(objects_dir(backups_dir)):
+        for file in files:
+            if file not in referenced: # includes .tmp leftovers from an interrupted backup
+                os.remove(os.path.join(root, file))
+                deleted_objects += 1
+    return len(expired), deleted_objects
+
+# RESTORING ============================================================================================================
+
+def restore_backup(name: str, target_dir: str, backups_dir: str = BACKUPS_DIR) -> int:
+    """rebuilds backup name into target_dir, returns the number of files written"""
+    files = read_manifest(name, backups_dir).get("files", {})
+    for relative_path, entry in files.items():
+        path = os.path.join(target_dir, *relative_path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(read_object(entry["hash"], backups_dir))
+        os.replace(f"{path}.tmp", path)
+    return len(files)
+
+
+if __name__ == "__main__":
+    # python -m components.function.backup list
+    # python -m components.function.backup restore <backup name|latest> [target directory]
+    # restores next to savedata rather than over it, swap the folders over yourself once the bot is stopped
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "list":
+        for name in list_backups():
+            manifest = read_manifest(name)
+            print(f"{name}  {len(manifest.get('files', {}))} files")
+    elif command == "restore" and len(sys.argv) > 2:
+        name = sys.argv[2]
+        if name == "latest":
+            backups = list_backups()
+            if not backups:
+                print(f"there are no backups in {BACKUPS_DIR} to restore")
+                sys.exit(1)
+            name = backups[-1]
+        target = sys.argv[3] if len(sys.argv) > 3 else f"savedata_restored_{name}"
+        print(f"restored {restore_backup(name, target)} files from {name} into {target}")
+    else:
+        print("usage: python -m components.function.backup [list | restore <backup name|latest> [target directory]]")
+        sys.exit(1)
@@ -1,57 +1,328 @@
 import discord
-import math
-import operator
+import asyncio
+import os
 import random
+import time
+import weakref
 
 from components.classes.confighandler import ConfigHandler
-from components.function.savedata import get_guild_attribute, get_guild_member_attribute
-from components.shared_instances import bot, POINTS_DATABASE
+from components.classes.writebehind import WriteBehind
+from components.classes.points_journal import PointsJournal
+from components.classes.idle_tracker import IdleTracker
+from components.classes.compact_points import CompactPoints, memory_report
+from components.classes.points_table import PointsTable, PointsSnapshot
+import components.classes.level_curve as level_curve
+import components.function.levels.points_snapshot as points_snapshot
+from components.function.savedata import get_guild_attribute, delete_guild_attribute, io_executor, aget_guild_attribute, aset_guild_attribute, aupdate_guild_attribute
+from components.shared_instances import bot, POINTS_DATABASE, POINTS_FLUSH_INTERVAL, POINTS_MAX_STALENESS, POINTS_JOURNAL_COMPACT_BYTES, COMPACT_POINTS_THRESHOLD, GUILD_IDLE_SECONDS, GUILD_MAX_LOADED, RANK_INDEX_IDLE_SECONDS
 from components.function.logging import log
 
 K_FALLBACK = 5.34
 
-def points_to_level(points: int, confighandler: ConfigHandler) -> tuple[int, int]:
-    "returns level, remaining points to next level"
-
-    k = confighandler.get_attribute("k", fallback=K_FALLBACK)
-    k = K_FALLBACK if k == 0 else k
-
-    points_negative = points < 0
-    level = int(math.sqrt(abs(points)) / k)
-    level = -level if points_negative else level
-
-    xp_current = (level * k) ** 2       # total xp required to reach current level
-    xp_next = ((level + 1) * k) ** 2    #  total xp required to reach next level
+POINTS_DIR = os.path.join(os.getcwd(), "savedata", "points")
+
+def points_snapshot_path(guild_id: int) -> str:
+    return os.path.join(POINTS_DIR, f"{guild_id}.snapshot")
+
+def load_points_snapshot(guild_id: int) -> dict:
+    """reads a guild's binary points snapshot (or the one before it if it is damaged), importing the old yaml
+    points_data if the guild has never had one. raises SnapshotError rather than bringing back pre-migration
+    points if snapshots exist but none can be read"""
+    path = points_snapshot_path(guild_id)
+    candidates = [candidate for candidate in (path, points_snapshot.backup_path(path)) if os.path.exists(candidate)]
+    if not candidates:
+        return import_points_yaml(guild_id)
+
+    for candidate in candidates:
+        try:
+            user_ids, points = points_snapshot.read_snapshot_arrays(candidate)
+        except (OSError, points_snapshot.SnapshotError) as e:
+            log(f"~1could not read points snapshot {candidate} for guild {guild_id}: {e}")
+            continue
+        if candidate != path:
+            log(f"~1using the previous points snapshot for guild {guild_id}, changes compacted since it was written are lost")
+        if len(user_ids) >= COMPACT_POINTS_THRESHOLD:
+            return CompactPoints.from_arrays(user_ids, points) # no dict in between
+        return dict(zip(user_ids, points))
+
+    raise points_snapshot.SnapshotError(f"no readable points snapshot for guild {guild_id}, restore one from a backup (see backup.py)")
+
+def save_points_snapshot(guild_id: int, points: dict):
+    if isinstance(points, PointsSnapshot):
+        points = points.data
+    if isinstance(points, CompactPoints):
+        points.merge()
+        points_snapshot.write_snapshot_arrays(points_snapshot_path(guild_id), points.user_ids, points.points)
+        return
+    points_snapshot.write_snapshot(points_snapshot_path(guild_id), points)
+
+def import_points_yaml(guild_id: int) -> dict:
+    """reads the guild's points from the yaml points_data attribute (the pre-snapshot format). only used until
+    the guild's first snapshot is written, see load_guild_points"""
+    points = get_guild_attribute(guild_id, "points_data")
+    return points if isinstance(points, dict) else {}
+
+points_journal = PointsJournal(
+    directory=POINTS_DIR,
+    load_snapshot=load_points_snapshot,
+    save_snapshot=save_points_snapshot,
+    compact_bytes=POINTS_JOURNAL_COMPACT_BYTES,
+    executor=io_executor # share the savedata i/o thread so all writes are issued in order
+)
+
+points_writer = WriteBehind(
+    persist=points_journal.append,
+    flush_interval=POINTS_FLUSH_INTERVAL,
+    max_staleness=POINTS_MAX_STALENESS,
+    executor=points_journal.executor
+)
+
+points_usage = IdleTracker(idle_seconds=GUILD_IDLE_SECONDS, max_loaded=GUILD_MAX_LOADED)
+
+def load_guild_points(guild_id: int) -> PointsTable:
+    """loads a guild's points from its snapshot and journal. very large guilds are backed by a CompactPoints instead of a dict"""
+    snapshot_path = points_snapshot_path(guild_id)
+    importing = not os.path.exists(snapshot_path) and not os.path.exists(points_snapshot.backup_path(snapshot_path))
+    points = points_journal.load(guild_id)
+    if importing:
+        # write the first snapshot straight away and drop points_data, otherwise the whole old points table is
+        # dumped again with every other change to the guild's savedata
+        points_journal.compact(guild_id, {}, points)
+        delete_guild_attribute(guild_id, "points_data")
+        if points:
+            log(f"~2moved {len(points)} users' points for guild {guild_id} from points_data into a snapshot")
+    if len(points) >= COMPACT_POINTS_THRESHOLD and not isinstance(points, CompactPoints):
+        points = CompactPoints(points)
+    if isinstance(points, CompactPoints):
+        log(f"~2loaded {len(points)} users' points for guild {guild_id} compactly ({points.memory_usage() / 1e6:.1f}MB)")
+    return PointsTable(points)
+
+async def aload_guild_points(guild_id: int) -> PointsTable:
+    return await asyncio.get_running_loop().run_in_executor(points_journal.executor, load_guild_points, guild_id)
+
+# guilds' points are loaded into POINTS_DATABASE on first touch and dropped again once they go idle
+
+def get_guild_points(guild_id: int) -> PointsTable:
+    """returns the guild's live points, loading them if needed. loading blocks, so coroutines should
+    await ensure_guild_points first"""
+    points_usage.touch(guild_id)
+    points = POINTS_DATABASE.get(guild_id)
+    if points is None:
+        log(f"~3loading points for guild {guild_id} on the event loop")
+        points = load_guild_points(guild_id)
+        points.set_active(get_active_members(guild_id))
+        POINTS_DATABASE[guild_id] = points
+    return points
+
+async def ensure_guild_points(guild_id: int) -> PointsTable:
+    """makes sure the guild's points are in memory, loading them on the savedata i/o thread"""
+    points_usage.touch(guild_id)
+    if guild_id not in POINTS_DATABASE:
+        points = await aload_guild_points(guild_id)
+        if guild_id not in POINTS_DATABASE: # someone else may have loaded it while we waited
+            points.set_active(get_active_members(guild_id))
+            POINTS_DATABASE[guild_id] = points
+    return POINTS_DATABASE[guild_id]
+
+# MEMBERS ==============================================================================================================
+# only current members are ranked. the set starts from discord's member cache when a guild's points are loaded
+# and is kept up to date by member_joined/member_left. people who left keep their points, and once they've
+# been gone for the guild's prune_departed_days their points are moved to the archived_points attribute,
+# to be given back if they ever rejoin
+
+# departed_members and archived_points are read, changed and written back, so every change to them in a guild
+# goes through that guild's lock. a lock only lives while someone holds or waits on it
+_departure_locks = weakref.WeakValueDictionary()
+
+def departure_lock(guild_id: int) -> asyncio.Lock:
+    lock = _departure_locks.get(guild_id)
+    if lock is None:
+        lock = _departure_locks[guild_id] = asyncio.Lock()
+    return lock
+
+def get_active_members(guild_id: int) -> set | None:
+    """ids of the guild's current members, None (rank everyone) if the member list isn't fully cached"""
+    guild = bot.get_guild(guild_id)
+    if guild is None or not guild.chunked:
+        return None
+    return {member.id for member in guild.members}
+
+async def member_joined(guild_id: int, user_id: int):
+    guild_points = await ensure_guild_points(guild_id)
+
+    async with departure_lock(guild_id):
+        departed = await aget_guild_attribute(guild_id, "departed_members") or {}
+        if departed.pop(user_id, None) is not None:
+            await aset_guild_attribute(guild_id, "departed_members", departed)
+
+        archived = await aget_guild_attribute(guild_id, "archived_points") or {}
+        if user_id in archived:
+            archived_points = archived.pop(user_id)
+            await aset_guild_attribute(guild_id, "archived_points", archived)
+            if user_id in guild_points:
+                # archived but never compacted out (we stopped in between), the points we have are the live ones
+                log(f"~3user {user_id} rejoining guild {guild_id} still had points, dropping their archived ones")
+            else:
+                guild_points[user_id] = archived_points
+                points_writer.mark_dirty(guild_id, user_id)
+                log(f"~2restored {archived_points} archived points for rejoining user {user_id} in guild {guild_id}")
+
+    guild_points.activate(user_id)
+
+async def member_left(guild_id: int, user_id: int):
+    guild_points = await ensure_guild_points(guild_id)
+    guild_points.deactivate(user_id)
+    if user_id in guild_points:
+        async with departure_lock(guild_id):
+            await aupdate_guild_attribute(guild_id, "departed_members", {user_id: time.time()})
+
+async def archive_departed_points(guild_id: int, days: float) -> int:
+    """archives the points of users who left the guild more than days ago, returns how many were archived"""
+    guild_points = await ensure_guild_points(guild_id)
+    if guild_points.active is None:
+        return 0 # can't tell who has left
+
+    async with departure_lock(guild_id):
+        now = time.time()
+        departed = await aget_guild_attribute(guild_id, "departed_members") or {}
+        departed_before = len(departed)
+        for user_id in guild_points:
+            if user_id not in guild_points.active and user_id not in departed:
+                departed[user_id] = now # left while we weren't watching, their time starts now
+
+        cutoff = now - days * 24 * 60 * 60
+        expired = [user_id for user_id, left_at in departed.items() if left_at <= cutoff and user_id not in guild_points.active]
+        removed = {user_id: int(guild_points[user_id]) for user_id in expired if user_id in guild_points}
+        if removed:
+            archived = await aget_guild_attribute(guild_id, "archived_points") or {}
+            await aset_guild_attribute(guild_id, "archived_points", {**archived, **removed})
+            for user_id in removed:
+                del guild_points[user_id]
+            try:
+                # the journal only records values, so write a snapshot without them before it is replayed again
+                await compact_guild_points(guild_id)
+            except Exception:
+                # they'd come back from the journal on the next load, so take them back out of the archive
+                for user_id, user_points in removed.items():
+                    guild_points[user_id] = user_points
+                await aset_guild_attribute(guild_id, "archived_points", archived)
+                raise
+
+        for user_id in expired:
+            del departed[user_id]
+        if expired or len(departed) != departed_before:
+            await aset_guild_attribute(guild_id, "departed_members", departed)
+
+    return len(expired)
+
+def drop_cold_rank_indexes(idle_seconds: float = RANK_INDEX_IDLE_SECONDS) -> int:
+    """drops the rank indexes of loaded guilds nobody has looked at the leaderboard of for a while, returns how many"""
+    return sum(guild_points.drop_cold_ranks(idle_seconds) for guild_points in POINTS_DATABASE.values())
+
+def points_memory_report() -> dict:
+    """memory_report summed over every loaded guild"""
+    totals = {"guilds": 0, "compact_guilds": 0, "rank_indexes": 0, "users": 0, "total_bytes": 0, "rank_index_bytes": 0, "active_bytes": 0}
+    for guild_points in list(POINTS_DATABASE.values()):
+        report = memory_report(guild_points)
+        totals["guilds"] += 1
+        totals["compact_guilds"] += report["compact"]
+        totals["rank_indexes"] += guild_points.rank_index is not None
+        for key in ("users", "total_bytes", "rank_index_bytes", "active_bytes"):
+            totals[key] += report[key]
+    return totals
+
+async def evict_idle_guild_points() -> int:
+    """flushes and unloads the points of guilds that have gone idle, returns how many were evicted"""
+    evicted = 0
+    for guild_id in points_usage.evictable():
+        if guild_id not in POINTS_DATABASE:
+            points_usage.forget(guild_id)
+            continue
+
+        touched = points_usage.touched_at(guild_id)
+        version = POINTS_DATABASE[guild_id].version
+        try:
+            if points_journal.needs_compaction(guild_id):
+                await compact_guild_points(guild_id)
+            else:
+                await points_writer.flush_guild(guild_id, POINTS_DATABASE)
+        except Exception as e:
+            log(f"~1failed to flush points for idle guild {guild_id}, keeping it loaded: {e}")
+            continue
+
+        used_again = points_usage.touched_at(guild_id) != touched or POINTS_DATABASE[guild_id].version != version
+        if points_writer.is_dirty(guild_id) or used_again:
+            continue # it was used again while we were flushing
+
+        del POINTS_DATABASE[guild_id]
+        points_usage.forget(guild_id)
+        evicted += 1
+    return evicted
+
+async def compact_guild_points(guild_id: int):
+    """folds a guild's journal into a new snapshot without blocking the event loop"""
+    if guild_id not in POINTS_DATABASE:
+        return # not loaded, an empty snapshot would wipe it
 
-    remaining_points = xp_next - points # points needed to reach next level from where we are now
+    # unflushed changes and the snapshot are taken together so they describe the same moment. the snapshot
+    # is copy-on-write, so this costs nothing until the next message in the guild
+    changes = points_writer.take(guild_id, POINTS_DATABASE)
+    snapshot = POINTS_DATABASE[guild_id].snapshot()
+    try:
+        await asyncio.get_running_loop().run_in_executor(points_journal.executor, points_journal.compact, guild_id, changes, snapshot)
+    except Exception:
+        for user_id in changes: # they may not have reached the journal, so flush them again
+            points_writer.mark_dirty(guild_id, user_id)
+        raise
+    log(f"~2compacted points journal for guild {guild_id} ({len(snapshot)} users, version {snapshot.version})")
+
+# ConfigHandler -> (config version, curve). the settings are only read again once the config has changed, and
+# entries go with their config handler when it is evicted
+_guild_curves = weakref.WeakKeyDictionary()
+
+def get_curve(confighandler: ConfigHandler) -> level_curve.LevelCurve:
+    """returns the guild's level curve, quadratic with k unless the guild picked another one"""
+    cached = _guild_curves.get(confighandler)
+    if cached is not None and cached[0] == confighandler.version:
+        return cached[1]
+
+    settings = {}
+    for name in level_curve.CURVE_SETTINGS:
+        value = confighandler.get_attribute(name)
+        if value is not None:
+            settings[name] = value
+    curve = level_curve.get_curve(settings, K_FALLBACK)
+    _guild_curves[confighandler] = (confighandler.version, curve)
+    return curve
 
-    return level, int(remaining_points)
+def points_to_level(points: int, confighandler: ConfigHandler) -> tuple[int, int]:
+    "returns level, remaining points to next level"
+    return get_curve(confighandler).points_to_level(points)
 
 
 def level_to_points(level: int, confighandler: ConfigHandler) -> int:
-    k = confighandler.get_attribute("k", fallback=K_FALLBACK)
-
     # total xp required to reach this level
-    return int((level * k) ** 2)
-
-def get_guild_leaderboard(guild_id: int) -> list[tuple[int, int]]:
-    """returns the guild's leaderboard sorted high to low"""
-    points_db = get_guild_attribute(guild_id, "points_data")
-    if not isinstance(points_db, dict):
-        log("~1tried to get guild leaderboard, failed due to missing or malformed data")
-        return [] # no data or malformed data
-    log("~2attempting to sort leaderboard data")
-    leaderboard = sorted(points_db.items(), key=operator.itemgetter(1), reverse=True)
-    log("~2successfully sorted leadboard data")
-    return leaderboard
+    return int(get_curve(confighandler).points_for(level))
 
-def get_user_position(guild_id: int, target_user_id: int) -> int:
-    leaderboard = get_guild_leaderboard(guild_id)
+def get_users_with_at_least(guild_id: int, points: int) -> list[tuple[int, int]]:
+    """returns (user id, points) for everyone with at least points points, high to low"""
+    ranks = get_guild_points(guild_id).ranks()
+    return ranks.slice(0, ranks.count_at_least(points))
 
-    for position, (user_id, points) in enumerate(leaderboard):
-        if user_id == target_user_id:
-            return position + 1
-    return -1 # if the user is not found in the leaderboard
+def refresh_top_holders(guild_id: int, k: int) -> tuple[bool, tuple[int, ...]]:
+    """returns (whether they changed since the last call, user ids) for the holders of the top k positions"""
+    guild_points = get_guild_points(guild_id)
+    tracker = guild_points.track_top(k)
+    changed = tracker.refresh(guild_points.ranks())
+    return changed, tracker.holders
+
+def get_user_position(guild_id: int, target_user_id: int) -> int:
+    """returns a user's 1 based leaderboard position, or -1 if they aren't on it"""
+    guild_points = get_guild_points(guild_id)
+    points = guild_points.get(target_user_id)
+    if points is None or not guild_points.is_ranked(target_user_id):
+        return -1 # if the user is not found in the leaderboard
+    return guild_points.ranks().rank(target_user_id, points) + 1
 
 def get_user_progress(level, total, points_to_next_level, confighandler):
 
@@ -73,30 +344,12 @@ def get_user_progress(level, total, points_to_next_level, confighandler):
     # 4 TOTAL POINTS,       5 POINTS TO NEXT LEVEL, 
     # 6 PROGRESS,           7 USER THEME
 
-def format_leaderboard(guild_id: int, confighandler: ConfigHandler) -> list[tuple[str, str, int, int, int, int]]:
-    """returns a list of tuples: \n\nDISPLAY NAME, USER NAME, UUID, LEVEL, TOTAL POINTS, POINTS TO NEXT LEVEL"""
-    leaderboard = get_guild_leaderboard(guild_id)
-    guild = bot.get_guild(guild_id)
-
-    formatted_leaderboard = []
-    for user_id, points in leaderboard:
-        user = guild.get_member(user_id)
-
-        if not user:
-            continue # skip if no such user exists
-
-        displayname = user.display_name
-        username = user.name
-        total_points = int(points)
-        level, points_to_next = points_to_level(points, confighandler)
-
-        progress = get_user_progress(level, total_points, points_to_next, confighandler)
-        user_theme = get_guild_member_attribute(guild_id, user_id, "colour")
-
-        entry = (displayname, username, user_id, level, total_points, points_to_next, progress, user_theme)
-        formatted_leaderboard.append(entry)
-
-    return formatted_leaderboard
+def format_entry(user: discord.Member, points: int, confighandler: ConfigHandler, user_theme=None) -> tuple:
+    """formats one leaderboard entry in the format above"""
+    total_points = int(points)
+    level, points_to_next = points_to_level(points, confighandler)
+    progress = get_user_progress(level, total_points, points_to_next, confighandler)
+    return (user.display_name, user.name, user.id, level, total_points, points_to_next, progress, user_theme)
 
 def is_valid_range(given_range):
     if not isinstance(given_range, tuple):
@@ -131,23 +384,23 @@ def increment_user_points(guild:discord.Guild, user:discord.User, amount, config
     user_id = user.id
     user_name = user.name
 
-    if guild_id not in POINTS_DATABASE:
-        POINTS_DATABASE[guild_id] = {}
-    if user_id not in POINTS_DATABASE[guild_id]:
-        POINTS_DATABASE[guild_id][user_id] = 0
+    guild_points = get_guild_points(guild_id)
+    if user_id not in guild_points:
+        guild_points[user_id] = 0
 
     # get their current level
 
-    user_points_before = POINTS_DATABASE[guild_id][user_id]
+    user_points_before = guild_points[user_id]
     user_level_before, _  = points_to_level(user_points_before, confighandler)
 
     # increment the user's point value
 
-    POINTS_DATABASE[guild_id][user_id] += amount
+    guild_points[user_id] += amount
+    points_writer.mark_dirty(guild_id, user_id)
 
     # get their new level
 
-    user_points_after = POINTS_DATABASE[guild_id][user_id]
+    user_points_after = guild_points[user_id]
     user_level_after, _ = points_to_level(user_points_after, confighandler)
 
     # check if they have levelled up
@@ -158,6 +411,28 @@ def increment_user_points(guild:discord.Guild, user:discord.User, amount, config
 
     return user_points_after, has_levelled_up
 
+def set_user_points(guild:discord.Guild, user:discord.User, amount: int, confighandler:ConfigHandler) -> tuple[int, bool]:
+    """sets a user's points to an absolute value.
+    returns the new point value and a bool: True if the user has levelled up and False otherwise."""
+
+    guild_id = guild.id
+    user_id = user.id
+
+    guild_points = get_guild_points(guild_id)
+
+    user_points_before = guild_points.get(user_id, 0)
+    user_level_before, _ = points_to_level(user_points_before, confighandler)
+
+    guild_points[user_id] = int(amount)
+    points_writer.mark_dirty(guild_id, user_id)
+
+    user_points_after = guild_points[user_id]
+    user_level_after, _ = points_to_level(user_points_after, confighandler)
+
+    log(f"~2set {user.name}'s points to {user_points_after} in {guild.name}")
+
+    return user_points_after, user_level_after > user_level_before
+
 def hex_to_rgb(value: str) -> tuple[int, int, int]:
     value = value.lstrip('#')
     return tuple(int(value[i:i+2], 16) for i in (0, 2, 4))
@@ -0,0 +1,140 @@
+import asyncio
+import heapq
+import os
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from operator import itemgetter
+
+import components.function.levels.basic as lvbsc
+from components.classes.compact_points import CompactPoints
+from components.classes.global_leaderboard import GlobalLeaderboard
+from components.function.savedata import aget_guild_attribute
+from components.shared_instances import bot, POINTS_DATABASE, GLOBAL_LEADERBOARD_GUILD_TOP
+from components.function.logging import log
+
+# the global leaderboard is rebuilt every GLOBAL_LEADERBOARD_INTERVAL instead of per request. every guild gives
+# its top GLOBAL_LEADERBOARD_GUILD_TOP users sorted by user id, and heapq.merge interleaves them so each user's
+# guilds arrive next to each other. that folds every mode in one pass without a dict of all users, and requests
+# only ever read the last finished build. "sum" therefore only adds up the guilds a user is near the top of,
+# which is what decides the top of the global leaderboard anyway.
+#
+# guilds are read one at a time on their own thread, never on the savedata i/o thread, so a rebuild can't hold
+# up live config/member i/o. each guild's top users are kept with a stamp (its version if it's loaded, its
+# files' mtimes and sizes if not) and only read again once that changes, so quiet guilds cost nothing and
+# loaded ones aren't snapshotted (which makes their next write copy) unless they have changed. whether a guild
+# opted out is read once and then kept up to date by the Levels cog (see set_opted_out)
+
+GLOBAL_MODES = ("sum", "max")
+
+_POINTS_MIN = -(1 << 63)
+_POINTS_MAX = (1 << 63) - 1
+
+global_leaderboards = {} # mode -> GlobalLeaderboard, replaced whole on every rebuild
+
+_streams = {} # guild id -> (stamp, user ids, points) of its top users
+_opted_out = {} # guild id -> whether the Levels module is disabled there
+_reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="global-leaderboard")
+
+def get_global_leaderboard(mode: str = "sum") -> GlobalLeaderboard | None:
+    """the last built global leaderboard for mode, None until the first build finishes"""
+    return global_leaderboards.get(mode)
+
+def set_opted_out(guild_id: int, opted_out: bool):
+    _opted_out[guild_id] = opted_out
+
+def top_points(points, k: int = GLOBAL_LEADERBOARD_GUILD_TOP) -> tuple[array, array]:
+    """(user ids, points) of the k users with the most points in a guild, sorted by user id. blocking, run it
+    on a snapshot off the event loop"""
+    data = getattr(points, "data", points) # unwrap PointsTable / PointsSnapshot
+    items = data.iter_items() if isinstance(data, CompactPoints) else data.items()
+    top = sorted(heapq.nlargest(k, items, key=itemgetter(1)))
+    return array("Q", (user_id for user_id, _ in top)), array("q", (int(user_points) for _, user_points in top))
+
+def _stream(user_ids: array, points: array, active: set | None):
+    if active is None:
+        return zip(user_ids, points)
+    return ((user_id, user_points) for user_id, user_points in zip(user_ids, points) if user_id in active)
+
+def merge_guild_points(streams: list[tuple[array, array, set | None]], built_at: float) -> dict[str, GlobalLeaderboard]:
+    """k-way merges per guild (user ids, points, active members) streams into a GlobalLeaderboard per mode.
+    blocking, run it in an executor"""
+    user_ids = array("Q")
+    sums = array("q")
+    maxes = array("q")
+    merged = heapq.merge(*(_stream(*stream) for stream in streams))
+    for user_id, entries in groupby(merged, key=itemgetter(0)):
+        total = 0
+        best = _POINTS_MIN
+        for _, user_points in entries:
+            total += user_points
+            best = max(best, user_points)
+        user_ids.append(user_id)
+        sums.append(min(max(total, _POINTS_MIN), _POINTS_MAX))
+        maxes.append(best)
+
+    return {
+        "sum": GlobalLeaderboard("sum", user_ids, sums, len(streams), built_at),
+        "max": GlobalLeaderboard("max", user_ids, maxes, len(streams), built_at),
+    }
+
+def _disk_stamp(guild_id: int) -> tuple:
+    stamp = []
+    for path in (lvbsc.points_snapshot_path(guild_id), lvbsc.points_journal.journal_path(guild_id), lvbsc.points_journal.compacting_path(guild_id)):
+        try:
+            stat = os.stat(path)
+            stamp.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+def _read_stored(guild_id: int) -> tuple[array, array]:
+    return top_points(lvbsc.points_journal.read(guild_id))
+
+async def guild_stream(guild_id: int) -> tuple[array, array, set | None]:
+    """a guild's top users sorted by user id, from memory if it is loaded and from disk otherwise (without
+    loading it into POINTS_DATABASE, so the rebuild doesn't keep every guild in memory). reuses the last ones
+    if the guild hasn't changed since. members who left are skipped when merging, so a guild can give a few
+    less than GLOBAL_LEADERBOARD_GUILD_TOP"""
+    loop = asyncio.get_running_loop()
+    guild_points = POINTS_DATABASE.get(guild_id)
+    if guild_points is not None:
+        stamp = ("loaded", id(guild_points), guild_points.version)
+    else:
+        stamp = await loop.run_in_executor(_reader, _disk_stamp, guild_id)
+
+    cached = _streams.get(guild_id)
+    if cached is not None and cached[0] == stamp:
+        user_ids, points = cached[1], cached[2]
+    elif guild_points is not None:
+        user_ids, points = await loop.run_in_executor(_reader, top_points, guild_points.snapshot())
+    else:
+        user_ids, points = await loop.run_in_executor(_reader, _read_stored, guild_id)
+    _streams[guild_id] = (stamp, user_ids, points)
+    return user_ids, points, lvbsc.get_active_members(guild_id)
+
+async def rebuild_global_leaderboards():
+    started = time.monotonic()
+    streams = []
+    included = set()
+    for guild in list(bot.guilds):
+        if guild.id not in _opted_out:
+            _opted_out[guild.id] = "Levels" in (await aget_guild_attribute(guild.id, "disabled_cogs") or [])
+        if _opted_out[guild.id]:
+            continue # opted out, their members' points don't count
+        try:
+            streams.append(await guild_stream(guild.id))
+            included.add(guild.id)
+        except Exception as e:
+            log(f"~1could not read points of guild {guild.id} for the global leaderboard: {e}")
+
+    for guild_id in set(_streams) - included: # left, opted out or unreadable
+        del _streams[guild_id]
+    current = {guild.id for guild in bot.guilds}
+    for guild_id in set(_opted_out) - current:
+        del _opted_out[guild_id]
+
+    built = await asyncio.get_running_loop().run_in_executor(_reader, merge_guild_points, streams, time.time())
+    global_leaderboards.update(built)
+    log(f"~2rebuilt the global leaderboard from {len(streams)} guilds ({len(built['sum'])} users) in {time.monotonic() - started:.1f}s")
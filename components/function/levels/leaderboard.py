@@ -9,6 +9,7 @@ import components.shared_instances as shared
 import components.function.levels.image_constants as C
 import components.function.levels.basic as b
 from components.function.logging import log
+from components.function.levels.leaderboard_view import LeaderboardView
 from components.function.levels.graphics import (
     truncate,
     get_max_chars,
@@ -25,8 +26,12 @@ if LD_DEBUG:
     log("~3==================================================")
 
 
-def get_page(leaderboard, max_rows=5, page_requested=1) -> tuple[list, bool]:
-    """bool is whether or not we have too few entries to fill up a single page"""
+def get_page(leaderboard, max_rows=5, page_requested=1) -> tuple[list, list, int]:
+    """returns (entries, leaderboard indexes, total pages). leaderboard is a LeaderboardView (only the
+    requested page gets formatted) or an already formatted list"""
+
+    if isinstance(leaderboard, LeaderboardView):
+        return leaderboard.page(page_requested, max_rows * 2)
 
     # return a "page" from the leaderboard
     # page 1 - index 0-9
@@ -55,10 +60,11 @@ def get_page(leaderboard, max_rows=5, page_requested=1) -> tuple[list, bool]:
     return leaderboard[lower_bound:upper_bound], list(range(lower_bound, upper_bound)), int(math.ceil(len(leaderboard) / max_entries))
 
 
-def generate_leaderboard_image(guild_id: int, guild_name: str, leaderboard: list, max_rows: int, page_requested: int, theme: str = "red", icon=None) -> str:
-    "returns the path of the leaderboard image"
+def generate_leaderboard_image(guild_id: int, guild_name: str, leaderboard: list | LeaderboardView, max_rows: int, page_requested: int, theme: str = "red", icon=None, around_user_id: int = None) -> str:
+    """returns the path of the leaderboard image. with around_user_id (and a LeaderboardView) the page is the
+    window of positions centred on that user instead of page_requested"""
 
-    if LD_DEBUG:
+    if LD_DEBUG and isinstance(leaderboard, list):
         for i in range(30):
             dummy_entry = [
                 f"user{i+1}",       # DISPLAY NAME
@@ -81,7 +87,17 @@ def generate_leaderboard_image(guild_id: int, guild_name: str, leaderboard: list
 
     theme_palette = b.make_palette(theme)
 
-    lb_page_data, lb_indexes, total_pages = get_page(leaderboard, max_rows, page_requested)
+    window = None
+    if around_user_id is not None and isinstance(leaderboard, LeaderboardView):
+        window = leaderboard.around(around_user_id, max_rows * 2)
+
+    if window is not None:
+        # positions are absolute, so the top 3 still get their colours if the window reaches them
+        lb_page_data, lb_indexes, user_position = window
+        page_label = f"around #{user_position + 1} / {len(leaderboard)}"
+    else:
+        lb_page_data, lb_indexes, total_pages = get_page(leaderboard, max_rows, page_requested)
+        page_label = f"page {page_requested} / {total_pages}"
 
     image_height = C.LB_TITLEBAR_HEIGHT + (C.LB_USER_UNIT_HEIGHT + (C.COLUMN_PADDING[0]//2)) * max_rows
 
@@ -143,7 +159,7 @@ def generate_leaderboard_image(guild_id: int, guild_name: str, leaderboard: list
     )
 
     meta_text_top = f"{datetime.now().strftime('%d %m %y')}"
-    meta_text_middle = f"page {page_requested} / {total_pages}"
+    meta_text_middle = page_label
     meta_text_bottom = f"c-ldu {shared.version}"
     meta_text_font = C.TINY_LIGHT
     meta_text_max_chars = get_max_chars(meta_text_font, C.LB_TITLE_META_WIDTH)
@@ -0,0 +1,100 @@
+import math
+from collections import namedtuple
+
+import components.function.levels.basic as lvbsc
+from components.classes.confighandler import ConfigHandler
+from components.function.savedata import get_guild_member_attribute
+
+# what a rank card needs: the user's formatted entry and 0 based position, the formatted entries directly
+# above and below them (None at either end) and how many users are on the leaderboard
+RankContext = namedtuple("RankContext", ["entry", "position", "above", "below", "size"])
+
+
+class LeaderboardView:
+
+    """a guild's leaderboard that only formats the rows that are asked for.
+
+    positions and the page count come straight from the guild's rank index, so building a page costs the
+    same in a guild of 50 members as in one of 500k. await aget_member_table(guild_id) first so the theme
+    lookups don't touch the disk.
+
+    users who have left the guild aren't ranked at all (see PointsTable.active), so pages are always full"""
+
+    def __init__(self, guild, confighandler: ConfigHandler):
+        self.guild = guild
+        self.confighandler = confighandler
+        self.points = lvbsc.get_guild_points(guild.id)
+
+    def __len__(self):
+        return len(self.points.ranks())
+
+    def total_pages(self, per_page: int) -> int:
+        return max(1, math.ceil(len(self) / per_page))
+
+    def rows(self, start: int, stop: int) -> tuple[list[tuple], list[int]]:
+        """returns (formatted entries, their 0 based leaderboard positions) for positions start to stop"""
+        entries = []
+        positions = []
+        for position, (user_id, points) in enumerate(self.points.ranks().slice(start, stop), start):
+            entry = self._format(user_id, points)
+            if entry is None:
+                continue
+            entries.append(entry)
+            positions.append(position)
+        return entries, positions
+
+    def page(self, page_requested: int, per_page: int) -> tuple[list[tuple], list[int], int]:
+        """returns (entries, positions, total pages) for a 1 based page, same shape as leaderboard.get_page.
+        like get_page, a leaderboard shorter than a page is that one page whichever page is asked for"""
+        if len(self) < per_page:
+            entries, positions = self.rows(0, per_page)
+            return entries, positions, 1
+        start = per_page * (page_requested - 1)
+        entries, positions = self.rows(start, start + per_page)
+        return entries, positions, self.total_pages(per_page)
+
+    def around(self, user_id: int, per_page: int) -> tuple[list[tuple], list[int], int] | None:
+        """returns (entries, positions, the user's position) for the per_page positions centred on the user,
+        shifted to stay inside the leaderboard at either end. None if the user isn't ranked"""
+        points = self.points.get(user_id)
+        if points is None or not self.points.is_ranked(user_id):
+            return None
+        position = self.points.ranks().rank(user_id, points)
+        start = max(0, min(position - per_page // 2, len(self) - per_page))
+        entries, positions = self.rows(start, start + per_page)
+        return entries, positions, position
+
+    def _format(self, user_id: int, points: int):
+        member = self.guild.get_member(user_id)
+        if member is None:
+            return None
+        theme = get_guild_member_attribute(self.guild.id, user_id, "colour")
+        return lvbsc.format_entry(member, points, self.confighandler, theme)
+
+    def _neighbour(self, position: int, step: int):
+        """nearest formatted entry from position onwards in direction step, skipping anyone discord has
+        no member for"""
+        ranks = self.points.ranks()
+        while 0 <= position < len(ranks):
+            entry = self._format(*ranks.at(position))
+            if entry is not None:
+                return entry
+            position += step
+        return None
+
+    def rank_context(self, user_id: int) -> RankContext | None:
+        """the user's entry and the entries either side of it in O(log n), None if they have no points"""
+        points = self.points.get(user_id)
+        if points is None or not self.points.is_ranked(user_id):
+            return None
+        entry = self._format(user_id, points)
+        if entry is None:
+            return None
+        position = self.points.ranks().rank(user_id, points)
+        return RankContext(
+            entry=entry,
+            position=position,
+            above=self._neighbour(position - 1, -1),
+            below=self._neighbour(position + 1, 1),
+            size=len(self),
+        )
@@ -0,0 +1,104 @@
+import math
+import statistics
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError: # optional, everything here works without it, just slower on big guilds
+    np = None
+
+# batch versions of basic.points_to_level / get_user_progress for a whole guild at once. the guild's level curve
+# is resolved by the caller (basic.get_curve) once instead of twice per user. the numpy and pure python paths
+# give the same results
+
+STATS_PERCENTILES = (10, 25, 50, 75, 90, 99)
+
+def points_values(points) -> list:
+    """the points of everyone in a guild's points (a dict, PointsTable, snapshot or CompactPoints)"""
+    data = getattr(points, "data", points) # unwrap PointsTable / PointsSnapshot
+    overlay = getattr(data, "overlay", None)
+    if overlay is not None and not overlay:
+        return data.points # a fully merged CompactPoints already has them in an array
+    return [user_points for _, user_points in data.items()]
+
+def compute_levels(points, curve) -> tuple:
+    """returns (levels, points to next level, progress) for a sequence of point totals on a LevelCurve, as
+    numpy arrays when numpy is available and lists otherwise"""
+    if np is not None:
+        values = np.asarray(points, dtype=np.float64)
+        if not len(values) or np.abs(values).max() < curve.table[-1]:
+            return _compute_levels_numpy(values, curve)
+        points = values.tolist() # someone is past the end of the precomputed table, look them up one by one
+    return _compute_levels_python(points, curve)
+
+def _progress(since_current, to_next):
+    span = since_current + to_next
+    return 1 if span == 0 else min(max(since_current / span, 0), 1)
+
+def _compute_levels_python(points, curve) -> tuple[list, list, list]:
+    levels = []
+    remaining = []
+    progress = []
+    for user_points in points:
+        level, to_next = curve.points_to_level(user_points)
+        since_current = user_points - int(curve.points_for(level))
+
+        levels.append(level)
+        remaining.append(to_next)
+        progress.append(_progress(since_current, to_next))
+    return levels, remaining, progress
+
+def _compute_levels_numpy(values, curve) -> tuple:
+    table = np.asarray(curve.table, dtype=np.float64)
+    magnitudes = np.searchsorted(table, np.abs(values), side="right") - 1 # same as the curve's bisect
+    levels = np.where(values < 0, -magnitudes, magnitudes)
+    to_next = np.trunc(table[np.abs(levels + 1)] - values)
+
+    since_current = values - np.trunc(table[magnitudes])
+    span = since_current + to_next
+    with np.errstate(divide="ignore", invalid="ignore"):
+        progress = np.where(span == 0, 1.0, np.clip(since_current / span, 0, 1))
+    return levels.astype(np.int64), to_next.astype(np.int64), progress
+
+# STATS ================================================================================================================
+
+def level_stats(levels) -> dict:
+    """returns the count, median, nearest-rank percentiles and {level: users} histogram of a guild's levels"""
+    if np is not None:
+        levels = np.sort(np.asarray(levels, dtype=np.int64))
+        unique, counts = np.unique(levels, return_counts=True)
+        histogram = dict(zip(unique.tolist(), counts.tolist()))
+        median = float(np.median(levels)) if len(levels) else None
+        sorted_levels = levels.tolist()
+    else:
+        sorted_levels = sorted(levels)
+        histogram = dict(sorted(Counter(sorted_levels).items()))
+        median = float(statistics.median(sorted_levels)) if sorted_levels else None
+
+    count = len(sorted_levels)
+    percentiles = {}
+    if count:
+        for percentile in STATS_PERCENTILES:
+            percentiles[percentile] = sorted_levels[max(math.ceil(percentile / 100 * count) - 1, 0)]
+
+    return {"count": count, "median": median, "percentiles": percentiles, "histogram": histogram}
+
+def guild_level_stats(points, curve) -> dict:
+    """level_stats for a guild's points. blocking on big guilds, run it off the event loop on a snapshot"""
+    levels, _, _ = compute_levels(points_values(points), curve)
+    return level_stats(levels)
+
+def bucket_histogram(histogram: dict, buckets: int = 10) -> list[tuple[int, int, int]]:
+    """groups a {level: users} histogram into at most buckets ranges, returns (lowest level, highest level, users)"""
+    if not histogram:
+        return []
+    lowest = min(histogram)
+    highest = max(histogram)
+    width = max(1, math.ceil((highest - lowest + 1) / buckets))
+
+    grouped = []
+    for start in range(lowest, highest + 1, width):
+        end = start + width - 1
+        users = sum(count for level, count in histogram.items() if start <= level <= end)
+        grouped.append((start, end, users))
+    return grouped
@@ -0,0 +1,98 @@
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+# compact binary snapshot of one guild's points, used as the base the points journal is replayed on top of.
+#
+# layout (little endian):
+#   header  magic "LDUP", u16 version, u16 record size, u64 record count, u32 crc32 of the records
+#   records u64 user id, i64 points, sorted by user id
+#
+# loading memory-maps the file and reinterprets the records as flat arrays, so 100k users load in
+# milliseconds instead of the seconds yaml takes. yaml is still used to import old points_data and for
+# printing a snapshot in a readable form (see __main__).
+#
+# writing a snapshot moves the previous one to <path>.bak, to fall back on if the new one is ever unreadable
+
+MAGIC = b"LDUP"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQI")
+RECORD = struct.Struct("<Qq")
+UINT64_MASK = (1 << 64) - 1
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def backup_path(path: str) -> str:
+    return f"{path}.bak"
+
+
+def write_snapshot(path: str, points: dict) -> None:
+    """writes points to path atomically (temp file, fsync, rename)"""
+    user_ids = sorted(points)
+    write_snapshot_arrays(path, array("Q", user_ids), array("q", (int(points[user_id]) for user_id in user_ids)))
+
+def write_snapshot_arrays(path: str, user_ids: array, points: array) -> None:
+    """same as write_snapshot for points that are already arrays sorted by user id (see CompactPoints)"""
+    values = array("Q", bytes(RECORD.size * len(user_ids)))
+    values[0::2] = user_ids
+    values[1::2] = array("Q", points.tobytes()) # same bits, stored as two's complement
+    if sys.byteorder == "big":
+        values.byteswap()
+    body = values.tobytes()
+
+    header = HEADER.pack(MAGIC, VERSION, RECORD.size, len(user_ids), zlib.crc32(body))
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(header)
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    if os.path.exists(path):
+        os.replace(path, backup_path(path))
+    os.replace(temp_path, path)
+
+
+def read_snapshot_arrays(path: str) -> tuple[array, array]:
+    """returns (user ids as array('Q'), points as array('q')) sorted by user id. raises SnapshotError if the file is damaged"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER.size:
+            raise SnapshotError(f"{path} is too short to be a points snapshot")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            magic, version, record_size, count, checksum = HEADER.unpack_from(mapped, 0)
+            if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+                raise SnapshotError(f"{path} is not a version {VERSION} points snapshot")
+            if size != HEADER.size + count * RECORD.size:
+                raise SnapshotError(f"{path} is truncated")
+
+            with memoryview(mapped) as view, view[HEADER.size:] as body:
+                if zlib.crc32(body) != checksum:
+                    raise SnapshotError(f"{path} failed its checksum")
+                user_ids = array("Q")
+                user_ids.frombytes(body)
+                points = array("q")
+                points.frombytes(body)
+
+    if sys.byteorder == "big":
+        user_ids.byteswap()
+        points.byteswap()
+    return user_ids[0::2], points[1::2]
+
+
+def read_snapshot(path: str) -> dict:
+    """returns the snapshot at path as {user id: points}"""
+    user_ids, points = read_snapshot_arrays(path)
+    return dict(zip(user_ids, points))
+
+
+if __name__ == "__main__":
+    # python -m components.function.levels.points_snapshot <snapshot file>, prints it as yaml
+    import yaml
+    yaml.dump(read_snapshot(sys.argv[1]), sys.stdout, Dumper=yaml.SafeDumper)
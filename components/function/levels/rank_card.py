@@ -5,6 +5,7 @@ import io
 import components.function.levels.image_constants as C
 import components.function.levels.basic as b
 from components.function.logging import log
+from components.function.levels.leaderboard_view import RankContext
 from components.function.levels.graphics import (
     truncate,
     get_max_chars,
@@ -20,23 +21,16 @@ from components.function.levels.graphics import (
 # 6 PROGRESS,           7 USER THEME
 
 
-def find_user_in_leaderboard(leaderboard, user_id):
-    """returns the entry and index of the user in the leaderboard, or (None, -1) if not found"""
-    for i, entry in enumerate(leaderboard):
-        if entry[2] == user_id:
-            return entry, i
-    return None, -1
-
-
-def generate_rank_card_image(guild_id: int, guild_name: str, leaderboard: list, user_requested: int, theme: str = "red", avatar=None) -> str:
-    "returns the path of the rank card image"
+def generate_rank_card_image(guild_id: int, guild_name: str, rank_context: RankContext, theme: str = "red", avatar=None) -> str:
+    "returns the path of the rank card image. rank_context comes from LeaderboardView.rank_context"
 
     theme_palette = b.make_palette(C.PALETTES["black"])
 
-    entry, lb_index = find_user_in_leaderboard(leaderboard, user_requested)
-    if entry is None:
-        log(f"~1user {user_requested} not found in leaderboard, can't generate rank card")
+    if rank_context is None:
+        log(f"~1no rank context given, can't generate rank card")
         return None
+    entry = rank_context.entry
+    lb_index = rank_context.position
 
     surface = Image.new(
         size=(C.RANK_CARD_WIDTH, C.RANK_CARD_HEIGHT),
@@ -64,7 +58,7 @@ def generate_rank_card_image(guild_id: int, guild_name: str, leaderboard: list,
 
     display_name = truncate(entry[0], get_max_chars(C.BODY, C.RANK_CARD_TITLE_WIDTH - avatar_offset))
     username_text = truncate(f"@{entry[1]}", get_max_chars(C.BODY_LIGHT, C.RANK_CARD_TITLE_WIDTH - avatar_offset))
-    rank_text = f"#{lb_index + 1}" #/{len(leaderboard)}"
+    rank_text = f"#{lb_index + 1}" #/{rank_context.size}"
     guild_text = truncate(guild_name, get_max_chars(C.TINY_LIGHT, C.RANK_CARD_META_WIDTH))
     right_x = C.RANK_CARD_WIDTH - C.LB_TITLE_PADDING_L
     meta_line_step = C.TINY_LIGHT.getbbox("A")[3] + 7
@@ -75,18 +69,18 @@ def generate_rank_card_image(guild_id: int, guild_name: str, leaderboard: list,
     draw.text((right_x, C.LB_TITLE_PADDING_U + meta_line_step + 2), rank_text, font=C.TITLE_LIGHT, fill=theme_palette["text"], anchor="rt")
 
     rank_top_text = f"{entry[5]} points to next level"
-    if len(leaderboard) == 1:
+    if rank_context.above is None and rank_context.below is None:
         rank_bottom_text = None
-    elif lb_index == 0:
-        next_entry = leaderboard[1]
+    elif rank_context.above is None:
+        next_entry = rank_context.below
         gap = entry[4] - next_entry[4]
         rank_bottom_text = f"{gap} points ahead of {next_entry[1]}"
     else:
-        above_entry = leaderboard[lb_index - 1]
+        above_entry = rank_context.above
         gap = above_entry[4] - entry[4]
         rank_bottom_text = f"{gap} points behind {above_entry[1]}"
 
-    user_unit, mask = generate_user_unit(entry, lb_index, theme_palette, rank_mode=True, leaderboard_size=len(leaderboard), rank_top_text=rank_top_text, rank_bottom_text=rank_bottom_text)
+    user_unit, mask = generate_user_unit(entry, lb_index, theme_palette, rank_mode=True, leaderboard_size=rank_context.size, rank_top_text=rank_top_text, rank_bottom_text=rank_bottom_text)
 
     unit_pos = (
         C.RANK_CARD_LEFT_PAD,
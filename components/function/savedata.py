@@ -1,8 +1,75 @@
 import discord
+import asyncio
+import atexit
+import copy
 import os
+import threading
 import yaml
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from components.shared_instances import bot
+from components.shared_instances import bot, STORAGE_ENGINE, GUILD_IDLE_SECONDS, GUILD_MAX_LOADED
+from components.function.logging import log
+from components.classes.idle_tracker import IdleTracker
+
+if STORAGE_ENGINE == "sqlite":
+    import components.function.savedata_sqlite as sqlite_engine
+
+# READ CACHE ===========================================================================================================
+
+# parsed yaml documents keyed by path. an entry is only used while the file's mtime and size still match what
+# we parsed, and our own writes replace it directly, so edits made outside the bot are still picked up. the
+# mtime stored is taken from the same file descriptor the document was read from (or written to), so a
+# document can never be cached under the mtime of a newer version of the file.
+# callers always get a deep copy because they tend to mutate what they read (lists of disabled cogs, configs),
+# and writers copy only the value they change, so cached documents are never touched after being stored
+
+CACHE_MAX_ENTRIES = 1024
+
+_document_cache = OrderedDict() # path -> (mtime_ns, size, document)
+_cache_lock = threading.RLock()
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def _cache_store(yaml_path: str, document: dict, stat: os.stat_result) -> None:
+    with _cache_lock:
+        _document_cache[yaml_path] = (stat.st_mtime_ns, stat.st_size, document)
+        _document_cache.move_to_end(yaml_path)
+        while len(_document_cache) > CACHE_MAX_ENTRIES:
+            _document_cache.popitem(last=False)
+            _cache_stats["evictions"] += 1
+
+def _read_document(yaml_path: str) -> dict:
+    """returns the parsed (shared, don't mutate) contents of a yaml file. raises like open/yaml.safe_load"""
+    stat = os.stat(yaml_path)
+    with _cache_lock:
+        cached = _document_cache.get(yaml_path)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            _document_cache.move_to_end(yaml_path)
+            _cache_stats["hits"] += 1
+            return cached[2]
+        _cache_stats["misses"] += 1
+
+    with open(yaml_path, "r", encoding="utf-8") as f:
+        document = yaml.safe_load(f) or {}
+        stat = os.fstat(f.fileno())
+    _cache_store(yaml_path, document, stat)
+    return document
+
+def _write_document(yaml_path: str, document: dict) -> None:
+    """writes document and caches it as is, so it must not be mutated afterwards. the file is replaced in one
+    go, so nothing (backups included) ever sees it empty or half written"""
+    temp_path = f"{yaml_path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        yaml.dump(document, f, Dumper=yaml.SafeDumper)
+        f.flush()
+        stat = os.fstat(f.fileno())
+    os.replace(temp_path, yaml_path)
+    _cache_store(yaml_path, document, stat)
+
+def get_cache_stats() -> dict:
+    """returns hit/miss/eviction counters and the current size of the read cache"""
+    with _cache_lock:
+        return {**_cache_stats, "size": len(_document_cache), "max_size": CACHE_MAX_ENTRIES}
 
 # BASIC READ/WRITE FUNCTIONS ============================================================================================
 
@@ -12,8 +79,7 @@ def load_yaml(yaml_path: str) -> dict:
     assert os.path.exists(os.path.dirname(yaml_path)), "directory does not exist"
     assert os.path.exists(yaml_path), "file does not exist"
 
-    with open(yaml_path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f) or {}
+    return copy.deepcopy(_read_document(yaml_path))
 
 def read_attribute(yaml_path: str, key: str):
     """reads a top-level attribute from the specified yaml file, returns None if the attribute is not set"""
@@ -22,9 +88,8 @@ def read_attribute(yaml_path: str, key: str):
     assert os.path.exists(yaml_path), "file does not exist"
 
     try:
-        with open(yaml_path, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f) or {}
-            return data.get(key, None)
+        data = _read_document(yaml_path)
+        return copy.deepcopy(data.get(key, None))
     except (FileNotFoundError, yaml.YAMLError):
         return None
 
@@ -35,57 +100,168 @@ def set_attribute(yaml_path: str, key: str, value=True) -> None:
     # we obviously don't want to assert that the file exists because we may be creating it here
 
     try:
-        with open(yaml_path, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f) or {}
+        data = dict(_read_document(yaml_path)) # shallow copy is enough, we only replace a top-level key
+    except (FileNotFoundError, yaml.YAMLError):
+        data = {}
+
+    data[key] = copy.deepcopy(value) # the caller may keep mutating value, the cached document can't change
+
+    _write_document(yaml_path, data)
+
+def update_attribute(yaml_path: str, key: str, changes: dict) -> None:
+    """merges changes into a dictionary attribute in the specified yaml file, creating it if needed"""
+    assert yaml_path.endswith(".yaml"), "yaml_path must end with .yaml"
+    assert os.path.exists(os.path.dirname(yaml_path)), "directory does not exist"
+
+    try:
+        data = dict(_read_document(yaml_path))
     except (FileNotFoundError, yaml.YAMLError):
         data = {}
 
-    data[key] = value
+    current = data.get(key)
+    current = dict(current) if isinstance(current, dict) else {}
+    current.update(copy.deepcopy(changes))
+    data[key] = current
+
+    _write_document(yaml_path, data)
+
+def delete_attribute(yaml_path: str, key: str) -> None:
+    """removes a top-level attribute from the specified yaml file, if the file and attribute exist"""
+    assert yaml_path.endswith(".yaml"), "yaml_path must end with .yaml"
+
+    try:
+        data = _read_document(yaml_path)
+    except (FileNotFoundError, yaml.YAMLError):
+        return
+    if key not in data:
+        return
 
-    with open(yaml_path, "w", encoding="utf-8") as f:
-        yaml.dump(data, f, Dumper=yaml.SafeDumper)
+    data = dict(data)
+    del data[key]
+    _write_document(yaml_path, data)
 
 # USER DATA ============================================================================================================
 
+# member attributes are kept as one table per guild, {member id: {key: value}}, loaded once and then served
+# from memory. with the yaml engine the table lives in savedata/userdata/<guild>.yaml, older installs with one
+# file per member under savedata/userdata/<guild>/ are folded into it the first time the guild is touched.
+# the table is the source of truth while the bot runs, edit the files with the bot stopped. tables of guilds
+# that go idle are dropped again by evict_idle_member_tables, like guild points and configs
+
 user_data_dir = os.path.join(os.getcwd(), "savedata", "userdata")
 os.makedirs(user_data_dir, exist_ok=True)
 
-def set_guild_member_attribute(guild_id: int, member_id: int, key: str, value=True) -> None:
-    """sets a user's attribute in the user data directory, default value is True"""
+_member_tables = {} # guild id -> {member id: {key: value}}
+_member_tables_lock = threading.RLock()
+_member_table_usage = IdleTracker(idle_seconds=GUILD_IDLE_SECONDS, max_loaded=GUILD_MAX_LOADED) # guarded by _member_tables_lock
 
-    user_data_path = os.path.join(user_data_dir, str(guild_id))
-    os.makedirs(user_data_path, exist_ok=True)
-    user_data_path = os.path.join(user_data_path, f"{member_id}.yaml")
+# yaml tables are dumped from a copy outside _member_tables_lock so readers never wait on the disk. each change
+# gets a version, and a dump older than the last one written is skipped, so the file never goes backwards
+_member_table_versions = {}  # guild id -> version of the last change
+_member_written_versions = {} # guild id -> version last written to disk
+_member_write_lock = threading.Lock()
 
-    set_attribute(user_data_path, key, value)
+def _load_member_table_yaml(guild_id: int) -> dict:
+    table_path = os.path.join(user_data_dir, f"{guild_id}.yaml")
+    if os.path.exists(table_path):
+        with open(table_path, "r", encoding="utf-8") as f:
+            return yaml.safe_load(f) or {}
 
+    table = {}
+    legacy_dir = os.path.join(user_data_dir, str(guild_id))
+    if os.path.isdir(legacy_dir):
+        for file in os.listdir(legacy_dir):
+            if not file.endswith(".yaml"):
+                continue
+            try:
+                member_id = int(file[:-len(".yaml")])
+            except ValueError:
+                log(f"~3skipping {os.path.join(legacy_dir, file)}, it isn't named after a member id")
+                continue
+            try:
+                with open(os.path.join(legacy_dir, file), "r", encoding="utf-8") as f:
+                    attributes = yaml.safe_load(f) or {}
+            except yaml.YAMLError:
+                continue
+            if attributes:
+                table[member_id] = attributes
+        _write_member_table_yaml(guild_id, table)
+        log(f"~2merged {len(table)} member files for guild {guild_id} into {table_path}")
+    return table
 
-def get_guild_member_attribute(guild_id: int, member_id: int, key: str):
-    """gets a user's attribute from the user data directory. returns none if attribute is not set"""
+def _write_member_table_yaml(guild_id: int, table: dict) -> None:
+    table_path = os.path.join(user_data_dir, f"{guild_id}.yaml")
+    temp_path = f"{table_path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        yaml.dump(table, f, Dumper=yaml.SafeDumper)
+    os.replace(temp_path, table_path)
 
-    user_data_path = os.path.join(user_data_dir, str(guild_id), f"{member_id}.yaml")
+def get_member_table(guild_id: int) -> dict:
+    """returns the guild's live {member id: {key: value}} table, loading it on first use. don't mutate it"""
+    with _member_tables_lock:
+        _member_table_usage.touch(guild_id)
+        table = _member_tables.get(guild_id)
+        if table is None:
+            if STORAGE_ENGINE == "sqlite":
+                table = sqlite_engine.get_member_table(guild_id)
+            else:
+                table = _load_member_table_yaml(guild_id)
+            _member_tables[guild_id] = table
+        return table
 
-    try:
-        return read_attribute(user_data_path, key)
-    except AssertionError:
-        return None
+def evict_idle_member_tables() -> int:
+    """drops the member tables of guilds that have gone idle, returns how many were dropped. every change is
+    written as it's made, so there is nothing to flush, but a table with a dump still on its way is kept"""
+    with _member_tables_lock:
+        evicted = 0
+        for guild_id in _member_table_usage.evictable():
+            if _member_written_versions.get(guild_id, 0) < _member_table_versions.get(guild_id, 0):
+                continue # being written right now, try again next time
+            _member_table_usage.forget(guild_id)
+            if _member_tables.pop(guild_id, None) is not None:
+                evicted += 1
+        return evicted
 
-def get_attribute_for_all_members(guild_id: int, key: str) -> dict:
-    """gets an attribute value for all users in a guild.\n\nreturns a dictionary of user ids and values.\n\nusers without the attribute are not included"""
+def set_guild_member_attribute(guild_id: int, member_id: int, key: str, value=True) -> None:
+    """sets a member's attribute in the guild's member table, default value is True"""
 
-    user_list = os.listdir(os.path.join(user_data_dir, str(guild_id)))
+    with _member_tables_lock:
+        table = get_member_table(guild_id)
+        table.setdefault(member_id, {})[key] = copy.deepcopy(value)
 
-    user_data = {}
+        if STORAGE_ENGINE == "sqlite":
+            sqlite_engine.set_guild_member_attribute(guild_id, member_id, key, value) # one row, no need to leave the lock
+            return
 
-    for user in user_list:
-        if not user.endswith(".yaml"):
-            continue
-        user = user.replace(".yaml", "")
-        user_value = get_guild_member_attribute(guild_id, int(user), key)
-        if user_value is not None:
-            user_data[int(user)] = user_value
+        version = _member_table_versions[guild_id] = _member_table_versions.get(guild_id, 0) + 1
+        # values are replaced rather than mutated, so copying two levels deep is a full snapshot
+        snapshot = {member: dict(attributes) for member, attributes in table.items()}
 
-    return user_data
+    with _member_write_lock:
+        if _member_written_versions.get(guild_id, 0) < version:
+            _write_member_table_yaml(guild_id, snapshot)
+            _member_written_versions[guild_id] = version
+
+
+def get_guild_member_attribute(guild_id: int, member_id: int, key: str):
+    """gets a member's attribute from the guild's member table. returns none if attribute is not set"""
+
+    with _member_tables_lock:
+        attributes = get_member_table(guild_id).get(member_id)
+        if attributes is None:
+            return None
+        return copy.deepcopy(attributes.get(key, None))
+
+def get_attribute_for_all_members(guild_id: int, key: str) -> dict:
+    """gets an attribute value for all users in a guild.\n\nreturns a dictionary of user ids and values.\n\nusers without the attribute are not included"""
+
+    with _member_tables_lock:
+        user_data = {}
+        for member_id, attributes in get_member_table(guild_id).items():
+            value = attributes.get(key)
+            if value is not None:
+                user_data[member_id] = copy.deepcopy(value)
+        return user_data
     
 # GUILD DATA ===========================================================================================================
 
@@ -95,16 +271,99 @@ os.makedirs(guild_data_dir, exist_ok=True)
 def set_guild_attribute(guild_id: int, key: str, value=True):
     """sets a guild's attribute in the guild data directory, default value is True"""
 
+    if STORAGE_ENGINE == "sqlite":
+        sqlite_engine.set_guild_attribute(guild_id, key, value)
+        return
+
     guild_data_path = os.path.join(guild_data_dir, f"{guild_id}.yaml")
 
     set_attribute(guild_data_path, key, value)
 
+def update_guild_attribute(guild_id: int, key: str, changes: dict):
+    """merges changes into one of a guild's dictionary attributes (e.g. departed_members) without replacing the rest of it"""
+
+    if STORAGE_ENGINE == "sqlite":
+        sqlite_engine.update_guild_attribute(guild_id, key, changes)
+        return
+
+    guild_data_path = os.path.join(guild_data_dir, f"{guild_id}.yaml")
+
+    update_attribute(guild_data_path, key, changes)
+
+def delete_guild_attribute(guild_id: int, key: str):
+    """removes one of a guild's attributes, doing nothing if it isn't set"""
+
+    if STORAGE_ENGINE == "sqlite":
+        sqlite_engine.delete_guild_attribute(guild_id, key)
+        return
+
+    guild_data_path = os.path.join(guild_data_dir, f"{guild_id}.yaml")
+
+    delete_attribute(guild_data_path, key)
+
 def get_guild_attribute(guild_id: int, key: str):
     """gets a guild's attribute from the guild data directory. returns none if attribute is not set"""
 
+    if STORAGE_ENGINE == "sqlite":
+        return sqlite_engine.get_guild_attribute(guild_id, key)
+
     guild_data_path = os.path.join(guild_data_dir, f"{guild_id}.yaml")
 
     try:
         return read_attribute(guild_data_path, key)
     except AssertionError:
         return None
+
+# ASYNC API ============================================================================================================
+
+# awaitable versions of the functions above for use from coroutines. every call runs on one dedicated i/o
+# thread, so operations on the same file always complete in the order they were issued and the event loop
+# never blocks on the disk. IO_QUEUE_LIMIT caps how many calls can be waiting at once, beyond that callers
+# wait for a slot instead of piling up work
+
+IO_QUEUE_LIMIT = 256
+
+io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="savedata-io")
+_io_slots = asyncio.Semaphore(IO_QUEUE_LIMIT)
+
+async def run_io(func, *args):
+    """runs a blocking function on the savedata i/o thread and returns its result"""
+    async with _io_slots:
+        return await asyncio.get_running_loop().run_in_executor(io_executor, func, *args)
+
+async def aset_guild_member_attribute(guild_id: int, member_id: int, key: str, value=True) -> None:
+    await run_io(set_guild_member_attribute, guild_id, member_id, key, copy.deepcopy(value))
+
+async def aget_guild_member_attribute(guild_id: int, member_id: int, key: str):
+    return await run_io(get_guild_member_attribute, guild_id, member_id, key)
+
+async def aget_attribute_for_all_members(guild_id: int, key: str) -> dict:
+    return await run_io(get_attribute_for_all_members, guild_id, key)
+
+async def aget_member_table(guild_id: int) -> dict:
+    """loads the guild's member table on the i/o thread, after which member reads are in-memory lookups"""
+    return await run_io(get_member_table, guild_id)
+
+async def aevict_idle_member_tables() -> int:
+    # on the i/o thread, so it lands between member writes rather than in the middle of one
+    return await run_io(evict_idle_member_tables)
+
+async def aset_guild_attribute(guild_id: int, key: str, value=True) -> None:
+    # copied here so the caller can keep mutating its object while the write is queued
+    await run_io(set_guild_attribute, guild_id, key, copy.deepcopy(value))
+
+async def aupdate_guild_attribute(guild_id: int, key: str, changes: dict) -> None:
+    await run_io(update_guild_attribute, guild_id, key, copy.deepcopy(changes))
+
+async def aget_guild_attribute(guild_id: int, key: str):
+    return await run_io(get_guild_attribute, guild_id, key)
+
+# ENGINE SETUP =========================================================================================================
+
+if STORAGE_ENGINE == "sqlite":
+    # first start on the sqlite engine imports the existing yaml trees, after that this is a no-op
+    imported_guilds, imported_members = sqlite_engine.migrate_from_yaml(user_data_dir, guild_data_dir)
+    if imported_guilds or imported_members:
+        log(f"~2migrated {imported_guilds} guild files and {imported_members} member files to {sqlite_engine.DB_PATH}")
+    # runs after the i/o thread has finished its queue, so every write is in before the database is closed
+    atexit.register(sqlite_engine.close_connection)
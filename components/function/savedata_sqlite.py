@@ -0,0 +1,280 @@
+import os
+import sqlite3
+import threading
+import yaml
+from contextlib import contextmanager
+
+from components.function.logging import log
+
+# sqlite storage engine for savedata.py, enabled by setting STORAGE_ENGINE = "sqlite" in shared_instances
+# values are stored as yaml text so they round-trip exactly like the yaml engine (int keys, tuples etc.)
+# points aren't stored here, they live in the binary snapshots and journals under savedata/points with either
+# engine. a points_data attribute (from importing the yaml tree) is read once when the guild's first snapshot
+# is written and then deleted, see levels/basic.py
+
+DB_PATH = os.path.join(os.getcwd(), "savedata", "ldu.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS guild_attributes (
+    guild_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (guild_id, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS member_attributes (
+    guild_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (guild_id, member_id, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS member_attributes_by_key ON member_attributes (guild_id, key);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_connection = None
+_lock = threading.RLock() # one connection shared between threads, so serialise access to it
+
+# CONNECTION ===========================================================================================================
+
+def get_connection() -> sqlite3.Connection:
+    """opens the database on first use (WAL mode) and returns the shared connection"""
+    global _connection
+    with _lock:
+        if _connection is None:
+            os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+            connection = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            _fold_points_table(connection)
+            _connection = connection
+        return _connection
+
+def _fold_points_table(connection: sqlite3.Connection) -> None:
+    """databases from before points moved to snapshots have a points table, turn it back into points_data
+    attributes (which the guilds import on their next load) and drop it"""
+    if connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'points'").fetchone() is None:
+        return
+    connection.execute("BEGIN")
+    try:
+        guild_ids = [row[0] for row in connection.execute("SELECT DISTINCT guild_id FROM points").fetchall()]
+        for guild_id in guild_ids:
+            rows = connection.execute("SELECT user_id, points FROM points WHERE guild_id = ?", (guild_id,)).fetchall()
+            connection.execute(
+                "INSERT OR IGNORE INTO guild_attributes (guild_id, key, value) VALUES (?, 'points_data', ?)",
+                (guild_id, encode(dict(rows)))
+            )
+        connection.execute("DROP TABLE points")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+    log(f"~2moved the points table of {len(guild_ids)} guilds back into points_data")
+
+def close_connection() -> None:
+    global _connection
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+@contextmanager
+def transaction():
+    """holds the lock and wraps the block in a single transaction, nested uses join the outer one"""
+    with _lock:
+        connection = get_connection()
+        if connection.in_transaction:
+            yield connection
+            return
+        connection.execute("BEGIN")
+        try:
+            yield connection
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+def encode(value) -> str:
+    return yaml.dump(value, Dumper=yaml.SafeDumper)
+
+def decode(text: str):
+    if text is None:
+        return None
+    return yaml.safe_load(text)
+
+# USER DATA ============================================================================================================
+
+def set_guild_member_attribute(guild_id: int, member_id: int, key: str, value=True) -> None:
+    with _lock:
+        get_connection().execute(
+            "INSERT OR REPLACE INTO member_attributes (guild_id, member_id, key, value) VALUES (?, ?, ?, ?)",
+            (guild_id, member_id, key, encode(value))
+        )
+
+def get_guild_member_attribute(guild_id: int, member_id: int, key: str):
+    with _lock:
+        row = get_connection().execute(
+            "SELECT value FROM member_attributes WHERE guild_id = ? AND member_id = ? AND key = ?",
+            (guild_id, member_id, key)
+        ).fetchone()
+    return decode(row[0]) if row else None
+
+def get_attribute_for_all_members(guild_id: int, key: str) -> dict:
+    with _lock:
+        rows = get_connection().execute(
+            "SELECT member_id, value FROM member_attributes WHERE guild_id = ? AND key = ?",
+            (guild_id, key)
+        ).fetchall()
+
+    user_data = {}
+    for member_id, text in rows:
+        value = decode(text)
+        if value is not None: # match the yaml engine, unset and None look the same
+            user_data[member_id] = value
+    return user_data
+
+def get_member_table(guild_id: int) -> dict:
+    """returns every member attribute in a guild as {member id: {key: value}}"""
+    with _lock:
+        rows = get_connection().execute(
+            "SELECT member_id, key, value FROM member_attributes WHERE guild_id = ?",
+            (guild_id,)
+        ).fetchall()
+
+    table = {}
+    for member_id, key, text in rows:
+        table.setdefault(member_id, {})[key] = decode(text)
+    return table
+
+# GUILD DATA ===========================================================================================================
+
+def set_guild_attribute(guild_id: int, key: str, value=True) -> None:
+    with _lock:
+        get_connection().execute(
+            "INSERT OR REPLACE INTO guild_attributes (guild_id, key, value) VALUES (?, ?, ?)",
+            (guild_id, key, encode(value))
+        )
+
+def update_guild_attribute(guild_id: int, key: str, changes: dict) -> None:
+    """merges changes into a dict attribute"""
+    with transaction():
+        current = get_guild_attribute(guild_id, key)
+        if not isinstance(current, dict):
+            current = {}
+        current.update(changes)
+        set_guild_attribute(guild_id, key, current)
+
+def delete_guild_attribute(guild_id: int, key: str) -> None:
+    with _lock:
+        get_connection().execute("DELETE FROM guild_attributes WHERE guild_id = ? AND key = ?", (guild_id, key))
+
+def get_guild_attribute(guild_id: int, key: str):
+    with _lock:
+        row = get_connection().execute(
+            "SELECT value FROM guild_attributes WHERE guild_id = ? AND key = ?",
+            (guild_id, key)
+        ).fetchone()
+    return decode(row[0]) if row else None
+
+# MIGRATION ============================================================================================================
+
+def is_migrated() -> bool:
+    with _lock:
+        row = get_connection().execute("SELECT value FROM meta WHERE key = 'yaml_migrated'").fetchone()
+    return row is not None
+
+def _read_yaml(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def _numeric_id(name: str, path: str) -> int | None:
+    """the id a savedata file/directory is named after, None (and a warning) for anything else in there"""
+    try:
+        return int(name)
+    except ValueError:
+        log(f"~3skipping {os.path.join(path, name)} while importing yaml savedata, it isn't named after an id")
+        return None
+
+def migrate_from_yaml(user_data_dir: str, guild_data_dir: str, force: bool = False) -> tuple[int, int]:
+    """one-shot import of the savedata/guilddata and savedata/userdata yaml trees into the database.
+    returns (guild files, member files) imported. does nothing if it has already run unless force is set"""
+
+    if is_migrated() and not force:
+        return 0, 0
+
+    guild_files = 0
+    member_files = 0
+
+    with transaction() as connection:
+        if os.path.isdir(guild_data_dir):
+            for file in os.listdir(guild_data_dir):
+                if not file.endswith(".yaml"):
+                    continue
+                guild_id = _numeric_id(file[:-len(".yaml")], guild_data_dir)
+                if guild_id is None:
+                    continue
+                for key, value in _read_yaml(os.path.join(guild_data_dir, file)).items():
+                    set_guild_attribute(guild_id, key, value)
+                guild_files += 1
+
+        if os.path.isdir(user_data_dir):
+            entries = os.listdir(user_data_dir)
+
+            # old layout, one file per member under userdata/<guild>/
+            for guild_dir in entries:
+                guild_path = os.path.join(user_data_dir, guild_dir)
+                if not os.path.isdir(guild_path):
+                    continue
+                guild_id = _numeric_id(guild_dir, user_data_dir)
+                if guild_id is None:
+                    continue
+                for file in os.listdir(guild_path):
+                    if not file.endswith(".yaml"):
+                        continue
+                    member_id = _numeric_id(file[:-len(".yaml")], guild_path)
+                    if member_id is None:
+                        continue
+                    for key, value in _read_yaml(os.path.join(guild_path, file)).items():
+                        set_guild_member_attribute(guild_id, member_id, key, value)
+                    member_files += 1
+
+            # current layout, one table per guild in userdata/<guild>.yaml. newer than the above so it wins
+            for file in entries:
+                if not file.endswith(".yaml"):
+                    continue
+                guild_id = _numeric_id(file[:-len(".yaml")], user_data_dir)
+                if guild_id is None:
+                    continue
+                table_path = os.path.join(user_data_dir, file)
+                for member_id, attributes in _read_yaml(table_path).items():
+                    member_id = _numeric_id(str(member_id), table_path)
+                    if member_id is None or not isinstance(attributes, dict):
+                        continue
+                    for key, value in attributes.items():
+                        set_guild_member_attribute(guild_id, member_id, key, value)
+                    member_files += 1
+
+        connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('yaml_migrated', ?)", (f"{guild_files},{member_files}",))
+
+    return guild_files, member_files
+
+
+if __name__ == "__main__":
+    # python -m components.function.savedata_sqlite, re-runs the import even if it has already happened
+    savedata_dir = os.path.join(os.getcwd(), "savedata")
+    guilds, members = migrate_from_yaml(
+        os.path.join(savedata_dir, "userdata"),
+        os.path.join(savedata_dir, "guilddata"),
+        force=True
+    )
+    print(f"imported {guilds} guild files and {members} member files into {DB_PATH}")
@@ -30,6 +30,34 @@ logged_amount = 0
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 TYPEFACE_DIR = PROJECT_ROOT / 'assets' / 'type'
 
+### savedata ###
+
+STORAGE_ENGINE = "yaml" # "yaml" for the per-guild/per-member yaml files, "sqlite" for savedata/ldu.db
+
+BACKUP_INTERVAL = 6 * 60 * 60   # seconds between savedata backups
+BACKUP_KEEP = 28                # backups kept before the oldest are pruned (a week at the default interval)
+
 ### points ###
 
-POINTS_DATABASE = {} # not great practice to have this here but whatevs
\ No newline at end of file
+POINTS_DATABASE = {} # not great practice to have this here but whatevs
+
+POINTS_FLUSH_INTERVAL = 5   # seconds a guild's points have to be untouched before they are written
+POINTS_MAX_STALENESS = 30   # seconds a busy guild's points can go unwritten before they are written anyway
+POINTS_COMPACT_INTERVAL = 300           # seconds between checks for journals that need compacting
+POINTS_JOURNAL_COMPACT_BYTES = 1 << 20  # journal size at which it gets folded into a new snapshot
+COMPACT_POINTS_THRESHOLD = 50_000       # guilds with at least this many users keep their points in arrays instead of a dict
+GLOBAL_LEADERBOARD_INTERVAL = 30 * 60   # seconds between rebuilds of the cross-guild leaderboard
+GLOBAL_LEADERBOARD_GUILD_TOP = 100      # users per guild that count towards the global leaderboard
+XP_BATCH_SIZE = 1000                    # most queued points awards applied in one pass
+XP_QUEUE_MAX = 50_000                   # queued points awards past which new ones are dropped
+LEVELUP_WORKERS = 4                     # level up announcements sent at once
+
+### guild state ###
+
+GUILD_IDLE_SECONDS = 30 * 60    # guild points/configs untouched for this long are flushed and dropped from memory
+GUILD_MAX_LOADED = 500          # most guilds kept in memory at once, the least recently used go first
+GUILD_EVICT_INTERVAL = 60       # seconds between eviction passes
+PRUNE_DEPARTED_INTERVAL = 24 * 60 * 60 # seconds between archiving the points of members who left long ago
+POSITION_ROLES_RECONCILE_INTERVAL = 60 * 60 # seconds between forced position role checks, longer than GUILD_IDLE_SECONDS so they don't keep guilds loaded
+RANK_INDEX_IDLE_SECONDS = 10 * 60 # unused leaderboard rank indexes are dropped after this long, they are rebuilt on the next request
+MEMORY_REPORT_INTERVAL = 60 * 60 # seconds between logging how much memory loaded guilds' points take
\ No newline at end of file
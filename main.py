@@ -14,10 +14,9 @@ import asyncio
 import os
 import sys
 import shutil
-import zipfile
-from datetime import datetime
 
-from components.shared_instances import bot, tree, version, shcogs
+from components.shared_instances import bot, tree, version, shcogs, BACKUP_INTERVAL
+from components.function import backup
 from components.function.logging import log
 from components.function.api_shorthand import sync_cogs_for_guild     
 from components.function.notif import send_dev_notif                                                      
@@ -35,24 +34,19 @@ log(f"~7              (version {version})")
 purge_flag_path = "savedata/global_commands_purged.flag"
 
 async def backup_savedata():
-    """backup savedata folder every 3 hours"""
-    backups_dir = os.path.join(os.path.dirname(os.getcwd()), 'ldu_backups')
-    os.makedirs(backups_dir, exist_ok=True)
-    log(f"~2started backup process, saving to {backups_dir}")
-    
+    """incremental backup of the savedata folder every BACKUP_INTERVAL seconds, off the event loop"""
+    log(f"~2started backup process, saving to {backup.BACKUPS_DIR}")
+    loop = asyncio.get_running_loop()
+
     while True:
+        await asyncio.sleep(BACKUP_INTERVAL)
         try:
-            await asyncio.sleep(6 * 60 * 60)  # 6 hours
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_path = os.path.join(backups_dir, f'savedata_backup_{timestamp}')
-            with zipfile.ZipFile(backup_path + '.zip', 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk('savedata'):
-                    dirs[:] = [d for d in dirs if os.path.join(root, d) != os.path.join('savedata', 'temp')]
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        zipf.write(file_path, os.path.relpath(file_path, 'savedata'))
-            log(f"~2savedata backed up to {backup_path}.zip")
-        except (OSError, zipfile.BadZipFile) as e:
+            name, total, stored = await loop.run_in_executor(None, backup.create_backup)
+            log(f"~2savedata backed up as {name} ({stored} new files stored, {total} in total)")
+            pruned, objects = await loop.run_in_executor(None, backup.prune_backups)
+            if pruned:
+                log(f"~2pruned {pruned} old backups ({objects} unused files)")
+        except (OSError, ValueError) as e:
             log(f"~1error backing up savedata: {e}")
 
 def int_to_string(i: int) -> str: